@@ -2,7 +2,10 @@ import torch
 import torch.cuda
 
 
-def evaluate_single(input_individual, input_model, data_loader, device):
+def evaluate_single(input_individual, input_model, data_loader, device, fitness_cache=None):
+    if fitness_cache is not None:
+        acc = fitness_cache.get(('full', input_individual))
+        if acc is not None: return acc
     correct = 0
     total = 0
     input_model = input_model.eval()
@@ -16,12 +19,11 @@ def evaluate_single(input_individual, input_model, data_loader, device):
             _, predicted = torch.max(outputs[0].data, 1)
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
+    if fitness_cache is not None: fitness_cache.put(('full', input_individual), 100 * correct / total)
     return 100 * correct / total
 
 
-def evaluate_individual_list(input_individual_list, ga, input_model, data_loader, device):
-    correct = 0
-    total = 0
+def evaluate_individual_list(input_individual_list, ga, input_model, data_loader, device, fitness_cache=None):
     input_model = input_model.eval()
     i = 0
     with torch.no_grad():
@@ -31,14 +33,41 @@ def evaluate_individual_list(input_individual_list, ga, input_model, data_loader
                     pass
                 else:
                     ind = input_individual_list[i]
-                    input_model.set_individual(ind)
-                    images, labels = data
-                    images = images.to(device)
-                    labels = labels.to(device)
-                    outputs = input_model(images)
-                    _, predicted = torch.max(outputs[0].data, 1)
-                    total += labels.size(0)
-                    correct += (predicted == labels).sum().item()
-                    acc = 100 * correct / total
+                    acc = None if fitness_cache is None else fitness_cache.get(('batch', ind))
+                    if acc is None:
+                        input_model.set_individual(ind)
+                        images, labels = data
+                        images = images.to(device)
+                        labels = labels.to(device)
+                        outputs = input_model(images)
+                        _, predicted = torch.max(outputs[0].data, 1)
+                        acc = 100 * (predicted == labels).sum().item() / labels.size(0)
+                        if fitness_cache is not None: fitness_cache.put(('batch', ind), acc)
                     ga.update_current_individual_fitness(ind, acc)
                     i += 1
+
+
+def evaluate_racing(input_individual_list, ga, input_model, data_loader, device, racing):
+    input_model = input_model.eval()
+    batches = []
+    data_iter = iter(data_loader)
+
+    def score_function(ind, start, stop):
+        input_model.set_individual(ind)
+        scores = []
+        for j in range(start, stop):
+            while len(batches) <= j:  # batches are loaded once and shared by all the individuals
+                images, labels = next(data_iter)
+                batches.append((images.to(device), labels.to(device)))
+            images, labels = batches[j]
+            outputs = input_model(images)
+            _, predicted = torch.max(outputs[0].data, 1)
+            scores.append(100 * (predicted == labels).sum().item() / labels.size(0))
+        return scores
+
+    input_individual_list = list(input_individual_list)
+    with torch.no_grad():
+        fitness, n_batches = racing.race(input_individual_list, score_function, len(data_loader))
+    for ind, acc in zip(input_individual_list, fitness):
+        ga.update_current_individual_fitness(ind, acc)
+    return n_batches
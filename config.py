@@ -38,6 +38,21 @@ def default_config_rnn():
             'mutation_p': 0.02,
             'p_cross_over': 1.0,
             'cross_over_type': 'Block',
+            'ga_engine': 'Object',
+            'steady_state': False,
+            'active_path': False,
+            'fitness_cache_size': 1000,
+            'racing': False,
+            'racing_confidence': 0.95,
+            'racing_initial_batches': 2,
+            'racing_keep': 5,
+            'n_eval_workers': 0,
+            'eval_threads': 1,
+            'export_final': False,
+            'compiled_cell': False,
+            'multi_eval_size': 1,
+            'stream_corpus': False,
+            'prefetch_batches': 4,
             'learning_rate': 20.0,
             'weight_decay': 0.0001,
             'dropout': 0.2,
@@ -52,6 +67,7 @@ def default_config_cnn():
             'n_blocks': 2,
             'n_block_type': 3,
             'n_nodes': 5,
+            'op_sharing': 'None',
             'n_channels': 20,
             'generation_size': 20,
             'generation_per_epoch': 2,
@@ -61,6 +77,18 @@ def default_config_cnn():
             'mutation_p': 0.02,
             'p_cross_over': 1.0,
             'cross_over_type': 'Block',
+            'ga_engine': 'Object',
+            'steady_state': False,
+            'canonical': False,
+            'active_path': False,
+            'fitness_cache_size': 1000,
+            'racing': False,
+            'racing_confidence': 0.95,
+            'racing_initial_batches': 2,
+            'racing_keep': 5,
+            'n_eval_workers': 0,
+            'eval_threads': 1,
+            'export_final': False,
             'learning_rate': 0.1,
             'lr_min': 0.0001,
             'weight_decay': 0.0001,
@@ -68,6 +96,10 @@ def default_config_cnn():
             'drop_path_keep_prob': 1.0,
             'drop_path_start_epoch': 50,
             'cutout': True,
+            'val_set': 'Loader',
+            'batch_augment': False,
+            'checkpoint_stages': [False, False, False],
+            'lazy_ops': False,
             'n_holes': 1,
             'length': 16,
             'LRType': 'MultiStepLR',
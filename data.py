@@ -1,4 +1,8 @@
 import os
+import json
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
 import torchvision
 import torchvision.transforms as transforms
@@ -17,6 +21,12 @@ def get_dataset(config):
         batch_size_train = config.get('batch_size')
         batch_size_val = config.get('batch_size_val')
         device = config.get('working_device')
+        if config.get('stream_corpus'):
+            return TokenStream(corpus.train.numpy(), batch_size_train, device,
+                               config.get('prefetch_batches')), TokenStream(corpus.valid.numpy(), batch_size_val,
+                                                                             device,
+                                                                             config.get('prefetch_batches')), len(
+                corpus.dictionary)
         # train_data, val_data, test_data = corpus.batchify(config.get('batch_size'), config.get('working_device'))
         return corpus.single_batchify(corpus.train, batch_size_train, device), corpus.single_batchify(corpus.valid,
                                                                                                       batch_size_val,
@@ -40,12 +50,12 @@ def get_cifar(config, data_path, dataset_name='CIFAR10'):
     transform = transforms.Compose([
         transforms.ToTensor(),
         normalize])
+    mean, std = normalize.mean, normalize.std
     trainloader, testloader, n_class = None, None, None
     if dataset_name == 'CIFAR10':
         trainset = torchvision.datasets.CIFAR10(root=data_path, train=True,
                                                 download=True, transform=train_transform)
-        trainloader = torch.utils.data.DataLoader(trainset, batch_size=config.get('batch_size'),
-                                                  shuffle=True, num_workers=4)
+        trainloader = get_train_loader(config, trainset, mean, std)
 
         testset = torchvision.datasets.CIFAR10(root=data_path, train=False,
                                                download=True, transform=transform)
@@ -55,8 +65,7 @@ def get_cifar(config, data_path, dataset_name='CIFAR10'):
     elif dataset_name == 'CIFAR100':
         trainset = torchvision.datasets.CIFAR100(root=data_path, train=True,
                                                  download=True, transform=train_transform)
-        trainloader = torch.utils.data.DataLoader(trainset, batch_size=config.get('batch_size'),
-                                                  shuffle=True, num_workers=4)
+        trainloader = get_train_loader(config, trainset, mean, std)
 
         testset = torchvision.datasets.CIFAR100(root=data_path, train=False,
                                                 download=True, transform=transform)
@@ -69,9 +78,177 @@ def get_cifar(config, data_path, dataset_name='CIFAR10'):
     return trainloader, testloader, n_class
 
 
+def get_train_loader(config, trainset, mean, std):
+    if config.get('batch_augment'):
+        return BatchAugmentLoader(trainset.data, trainset.targets, config.get('batch_size'), mean, std,
+                                  n_holes=config.get('n_holes') if config.get('cutout') else 0,
+                                  length=config.get('length'))
+    return torch.utils.data.DataLoader(trainset, batch_size=config.get('batch_size'), shuffle=True, num_workers=4,
+                                       persistent_workers=True)  # workers are kept between the epochs
+
+
+class BatchAugmentLoader(object):
+    """Training loader over in-memory uint8 images that augments whole batches with tensor operations.
+
+    Applies the same augmentation as the torchvision pipeline of get_cifar: random crop with zero padding,
+    horizontal flip, normalization and optionally cutout (holes are zeroed after the normalization, like Cutout).
+    Crop and flip are a single gather of the padded batch. The next batches are augmented by a background thread.
+    """
+
+    def __init__(self, images, labels, batch_size, mean, std, padding=4, n_holes=0, length=16, prefetch=2):
+        self.images = torch.from_numpy(images)  # [N,H,W,C] uint8
+        self.labels = torch.as_tensor(labels, dtype=torch.long)
+        self.batch_size = batch_size
+        self.scale = (1.0 / (255.0 * torch.tensor(std, dtype=torch.float))).view(1, -1, 1, 1)
+        self.shift = (torch.tensor(mean, dtype=torch.float) / torch.tensor(std, dtype=torch.float)).view(1, -1, 1, 1)
+        self.padding = padding
+        self.n_holes = n_holes
+        self.length = length
+        self.prefetch = prefetch
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        return (len(self.labels) + self.batch_size - 1) // self.batch_size
+
+    def augment(self, index):
+        images = self.images[index]
+        b, h, w, _ = images.shape
+        p = self.padding
+        if p > 0:
+            images = torch.nn.functional.pad(images, [0, 0, p, p, p, p])
+        rows = torch.randint(0, 2 * p + 1, (b, 1)) + torch.arange(h).view(1, -1)  # random crop
+        cols = torch.arange(w).view(1, -1).repeat(b, 1)
+        flip = torch.rand(b) < 0.5  # horizontal flip, folded into the crop columns
+        cols[flip] = cols[flip].flip(dims=[1])
+        cols = cols + torch.randint(0, 2 * p + 1, (b, 1))
+        images = images[torch.arange(b).view(-1, 1, 1), rows.view(b, h, 1), cols.view(b, 1, w)]
+        images = images.permute(0, 3, 1, 2).float() * self.scale - self.shift  # ToTensor and Normalize
+        if self.n_holes > 0:  # cutout
+            y = torch.randint(0, h, (b, self.n_holes, 1))
+            x = torch.randint(0, w, (b, self.n_holes, 1))
+            r = torch.arange(h).view(1, 1, -1)
+            c = torch.arange(w).view(1, 1, -1)
+            in_y = (r >= (y - self.length // 2).clamp(0, h)) & (r < (y + self.length // 2).clamp(0, h))
+            in_x = (c >= (x - self.length // 2).clamp(0, w)) & (c < (x + self.length // 2).clamp(0, w))
+            holes = (in_y.unsqueeze(dim=-1) & in_x.unsqueeze(dim=-2)).any(dim=1)
+            images = images * torch.logical_not(holes).unsqueeze(dim=1).float()
+        return images, self.labels[index]
+
+    def __iter__(self):
+        order = torch.randperm(len(self.labels))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        pending = [self.executor.submit(self.augment, index) for index in batches[:self.prefetch]]
+        for i in range(len(batches)):
+            if i + self.prefetch < len(batches):
+                pending.append(self.executor.submit(self.augment, batches[i + self.prefetch]))
+            yield pending.pop(0).result()
+
+
 class BatchIterator(object):
-    def __init__(self, data):
-        pass
+    """Iterates over fixed slices of pre-materialized (images, labels) tensors.
+
+    images can be a tensor (kept on the working device) or a memory-mapped numpy array, in which case each batch
+    is read from disk and the evaluation code moves it to the device.
+    """
+
+    def __init__(self, images, labels, batch_size):
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return (len(self.labels) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        for i in range(0, len(self.labels), self.batch_size):
+            images = self.images[i:i + self.batch_size]
+            if isinstance(images, np.ndarray): images = torch.from_numpy(np.array(images))  # read the slice from disk
+            yield images, self.labels[i:i + self.batch_size]
+
+
+def materialize_dataset(data_loader, device, path=None):
+    """Runs the loader transforms once and keeps the result, on device if path is None else as a .npy file in
+    path that is memory mapped."""
+    if path is None:
+        images, labels = zip(*[(images.to(device), labels.to(device)) for images, labels in data_loader])
+        return BatchIterator(torch.cat(images), torch.cat(labels), data_loader.batch_size)
+    file_name = os.path.join(path, 'val_images.npy')
+    images_mm = None
+    labels_list = []
+    i = 0
+    for images, labels in data_loader:
+        if images_mm is None:
+            images_mm = np.lib.format.open_memmap(file_name, mode='w+', dtype='float32',
+                                                  shape=(len(data_loader.dataset), *images.shape[1:]))
+        images_mm[i:i + images.shape[0]] = images.numpy()
+        labels_list.append(labels)
+        i += images.shape[0]
+    images_mm.flush()
+    del images_mm
+    return BatchIterator(np.load(file_name, mmap_mode='r'), torch.cat(labels_list).to(device),
+                         data_loader.batch_size)
+
+
+class TokenStream(object):
+    """Out-of-core replacement of a batchified token tensor.
+
+    Chunks have the same column layout as Corpus.single_batchify, column b holds the b-th contiguous part of the
+    token stream, but they are read from the (memory-mapped) token array when requested. While a chunk is used
+    the following ones are read and moved to the device by a background thread. len() and size(0) are the number
+    of rows of the batchified tensor, get_batch(i, bptt) returns the same (data, target) as rnn_utils.get_batch.
+    """
+
+    def __init__(self, ids, bsz, device, prefetch=4):
+        self.ids = ids
+        self.bsz = bsz
+        self.device = device
+        self.prefetch = prefetch
+        self.n_rows = len(ids) // bsz  # the tail that doesn't fit in a column is dropped, like single_batchify
+        self.pending = dict()  # (start, bptt) -> future of the chunk
+        self.executor = None
+        self.pid = None
+
+    def __len__(self):
+        return self.n_rows
+
+    def size(self, dim=0):
+        if dim != 0:
+            raise Exception('a token stream only has a row count')
+        return self.n_rows
+
+    def read(self, i, bptt):
+        seq_len = min(bptt, self.n_rows - 1 - i)
+        block = np.stack([self.ids[b * self.n_rows + i:b * self.n_rows + i + seq_len + 1] for b in range(self.bsz)])
+        block = torch.from_numpy(block.astype(np.int64).T.copy())  # [seq_len + 1, bsz]
+        block = block.to(self.device)
+        return block[:seq_len], block[1:].reshape(-1)
+
+    def get_batch(self, i, bptt):
+        if self.pid != os.getpid():  # threads don't survive a fork, a worker process starts its own
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self.pending = dict()
+            self.pid = os.getpid()
+        future = self.pending.pop((i, bptt), None)
+        if future is None:  # out of order access, drop the read ahead
+            self.pending = dict()
+        for j in range(i + bptt, min(i + (self.prefetch + 1) * bptt, self.n_rows - 1), bptt):
+            if (j, bptt) not in self.pending:
+                self.pending[(j, bptt)] = self.executor.submit(self.read, j, bptt)
+        return self.read(i, bptt) if future is None else future.result()
+
+    def close(self, wait=True):
+        if self.executor is not None and self.pid == os.getpid():
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+        self.executor = None
+        self.pending = dict()
+        self.pid = None
+
+    def __del__(self):
+        self.close(wait=False)  # the last reference can be dropped by the read ahead thread itself
+
+
+CORPUS_CACHE_VERSION = 1
+CORPUS_SPLITS = ['train', 'valid', 'test']
 
 
 class Dictionary(object):
@@ -90,7 +267,7 @@ class Dictionary(object):
 
 
 class Corpus(object):
-    def __init__(self, path):
+    def __init__(self, path, cache=True):
         # Starting from sequential dataset, batchify arranges the dataset into columns.
         # For instance, with the alphabet as the sequence and batch size 4, we'd get
         # ┌ a g m s ┐
@@ -103,9 +280,50 @@ class Corpus(object):
         # dependence of e. g. 'g' on 'f' can not be learned, but allows more efficient
         # batch processing.
         self.dictionary = Dictionary()
-        self.train = self.tokenize(os.path.join(path, 'train.txt'))
-        self.valid = self.tokenize(os.path.join(path, 'valid.txt'))
-        self.test = self.tokenize(os.path.join(path, 'test.txt'))
+        self.path = path
+        files = [os.path.join(path, split + '.txt') for split in CORPUS_SPLITS]
+        key = [[os.path.getsize(f), os.path.getmtime(f)] for f in files]  # the cache is valid for these files only
+        ids = self.load_cache(key) if cache else None
+        if ids is None:
+            ids = [self.tokenize(f) for f in files]
+            if cache and self.save_cache(key, ids):
+                ids = self.map_cache()  # drop the in memory ids, like a run that found the cache
+        self.train, self.valid, self.test = ids
+
+    def cache_file(self, name):
+        return os.path.join(self.path, 'corpus_cache_v' + str(CORPUS_CACHE_VERSION) + '.' + name)
+
+    def load_cache(self, key):
+        try:
+            with open(self.cache_file('json'), 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != CORPUS_CACHE_VERSION or meta.get('key') != key:
+                return None
+            ids = self.map_cache()
+        except (OSError, ValueError):
+            return None
+        for word in meta.get('idx2word'):
+            self.dictionary.add_word(word)
+        return ids
+
+    def map_cache(self):
+        # copy on write mapping, pages are read on first use
+        return [torch.from_numpy(np.load(self.cache_file(split + '.npy'), mmap_mode='c')) for split in CORPUS_SPLITS]
+
+    def save_cache(self, key, ids):
+        try:
+            for split, split_ids in zip(CORPUS_SPLITS, ids):
+                tmp_file = self.cache_file(split + '.tmp.npy')
+                np.save(tmp_file, split_ids.numpy())
+                os.replace(tmp_file, self.cache_file(split + '.npy'))
+            tmp_file = self.cache_file('tmp.json')
+            with open(tmp_file, 'w') as f:  # written last, an interrupted save leaves no valid cache behind
+                json.dump({'version': CORPUS_CACHE_VERSION, 'key': key, 'idx2word': self.dictionary.idx2word}, f)
+            os.replace(tmp_file, self.cache_file('json'))
+        except OSError:
+            print('Unable to write the corpus cache in:' + self.path)
+            return False
+        return True
 
     @staticmethod
     def single_batchify(data, bsz, input_device):
@@ -123,25 +341,10 @@ class Corpus(object):
             self.test, bsz, device)
 
     def tokenize(self, path):
-        """Tokenizes a text file."""
+        """Tokenizes a text file in a single pass, line by line into a packed id array."""
         assert os.path.exists(path)
-        # Add words to the dictionary
+        ids = array('q')  # 8 bytes per token instead of a list of word strings
         with open(path, 'r', encoding="utf8") as f:
-            tokens = 0
             for line in f:
-                words = line.split() + ['<eos>']
-                tokens += len(words)
-                for word in words:
-                    self.dictionary.add_word(word)
-
-        # Tokenize file content
-        with open(path, 'r', encoding="utf8") as f:
-            ids = torch.LongTensor(tokens)
-            token = 0
-            for line in f:
-                words = line.split() + ['<eos>']
-                for word in words:
-                    ids[token] = self.dictionary.word2idx[word]
-                    token += 1
-
-        return ids
+                ids.extend(map(self.dictionary.add_word, line.split() + ['<eos>']))
+        return torch.from_numpy(np.frombuffer(ids, dtype=np.int64) if len(ids) > 0 else np.zeros(0, dtype=np.int64))
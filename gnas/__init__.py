@@ -1,5 +1,9 @@
 from gnas.search_space.factory import get_gnas_cnn_search_space, get_gnas_rnn_search_space, SearchSpaceType
 from gnas.genetic_algorithm.genetic import genetic_algorithm_searcher
+from gnas.genetic_algorithm.fitness_cache import FitnessCache
+from gnas.genetic_algorithm.racing import RacingEvaluator
 from gnas.common.result import ResultAppender
+from gnas.common.parallel_evaluator import ParallelEvaluator
 from gnas import modules
 from gnas.common.graph_draw import draw_network
+from gnas.modules.export import export_network
@@ -0,0 +1,95 @@
+import queue
+import traceback
+import torch
+import torch.multiprocessing as mp
+
+
+def _worker_loop(model, search_space, evaluate_function, eval_args, n_threads, task_queue, result_queue):
+    torch.set_num_threads(n_threads)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index, genome = task
+        try:
+            individual = search_space.genome_to_individual(genome)
+            result_queue.put((index, evaluate_function(individual, model, *eval_args)))
+        except Exception:
+            result_queue.put((index, Exception(traceback.format_exc())))  # re-raised by the training process
+
+
+class ParallelEvaluator(object):
+    """Pool of worker processes that evaluate individuals against the current supernet weights.
+
+    The model parameters and buffers are moved to shared memory before the workers are forked, so every
+    optimizer step in the training process is visible to the workers without copying the state dict. Workers
+    only read the weights. Individuals are sent as genomes and decoded in the worker with its copy of the search
+    space. evaluate_function(individual, model, *eval_args) returns the fitness, e.g. cnn_utils.evaluate_single.
+    Only CPU models are supported, the validation data in eval_args must not start its own worker processes.
+    An exception in a worker, or a worker that died, is raised in the training process, the pool can't be used
+    afterwards.
+    """
+
+    def __init__(self, model, search_space, evaluate_function, eval_args=(), n_workers=2, n_threads=1):
+        if any([p.is_cuda for p in model.parameters()]):
+            raise Exception('parallel evaluation only supports cpu models')
+        model.share_memory()
+        ctx = mp.get_context('fork')
+        self.task_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.workers = [ctx.Process(target=_worker_loop,
+                                    args=(model, search_space, evaluate_function, eval_args, n_threads,
+                                          self.task_queue, self.result_queue), daemon=True)
+                        for _ in range(n_workers)]
+        [w.start() for w in self.workers]
+
+    def get_result(self, timeout=1.0):
+        while True:
+            try:
+                i, f = self.result_queue.get(timeout=timeout)
+                break
+            except queue.Empty:
+                if not all([w.is_alive() for w in self.workers]):
+                    raise Exception('an evaluation worker process died')
+        if isinstance(f, Exception):
+            raise Exception('evaluation failed in a worker process:\n' + str(f))
+        return i, f
+
+    def evaluate(self, individual_list):
+        individual_list = list(individual_list)
+        for i, ind in enumerate(individual_list):
+            self.task_queue.put((i, ind.code))
+        fitness = [None] * len(individual_list)
+        for _ in individual_list:
+            i, f = self.get_result()
+            fitness[i] = f
+        return fitness
+
+    def evaluate_stream(self, ga, n_results):
+        """Keeps every worker busy with candidates from a steady state GA until n_results came back."""
+        in_flight = dict()
+        n_submitted = 0
+        for _ in range(min(len(self.workers), n_results)):
+            in_flight[n_submitted] = ga.ask()
+            self.task_queue.put((n_submitted, in_flight[n_submitted].code))
+            n_submitted += 1
+        for _ in range(n_results):
+            i, f = self.get_result()
+            ga.update_current_individual_fitness(in_flight.pop(i), f)
+            if n_submitted < n_results:
+                in_flight[n_submitted] = ga.ask()
+                self.task_queue.put((n_submitted, in_flight[n_submitted].code))
+                n_submitted += 1
+
+    def evaluate_generation(self, ga):
+        if ga.steady_state:
+            return self.evaluate_stream(ga, len(ga.get_current_generation()))
+        generation = list(ga.get_current_generation())
+        for ind, f in zip(generation, self.evaluate(generation)):
+            ga.update_current_individual_fitness(ind, f)
+
+    def close(self):
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for w in self.workers:
+            w.join()
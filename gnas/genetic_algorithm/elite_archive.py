@@ -0,0 +1,124 @@
+import heapq
+import random
+import numpy as np
+
+
+class EliteArchive(object):
+    """Bounded set of the best individuals seen so far.
+
+    The worst member sits on top of a heap so insert and evict are O(log n), membership is a dict lookup and
+    members are also kept in a flat list so a random parent is sampled in O(1). Stale heap entries left behind
+    by fitness updates are skipped lazily and the heap is rebuilt when they outnumber the members.
+    """
+
+    def __init__(self, capacity, min_max=True):
+        self.capacity = capacity
+        self.sign = 1 if min_max else -1  # min_max=True keeps the largest fitness values
+        self.values_dict = dict()
+        self.members = []
+        self.position = dict()
+        self.entry = dict()
+        self.heap = []
+        self.i = 0
+        ####################################################################
+        # churn statistics
+        ####################################################################
+        self.n_insert = 0
+        self.n_evict = 0
+        self.n_reject = 0
+        self.n_update = 0
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, key):
+        return key in self.values_dict
+
+    def __str__(self):
+        return str(self.values_dict)
+
+    def keys(self):
+        return list(self.members)
+
+    def values(self):
+        return [self.values_dict[k] for k in self.members]
+
+    def items(self):
+        return [(k, self.values_dict[k]) for k in self.members]
+
+    def get(self, key, default=None):
+        return self.values_dict.get(key, default)
+
+    def _score(self, value):
+        score = self.sign * float(np.asarray(value).reshape(-1)[0])
+        return -np.inf if np.isnan(score) else score
+
+    def _push(self, key, value):
+        self.i += 1
+        self.entry[key] = self.i
+        heapq.heappush(self.heap, (self._score(value), -self.i, key))  # on ties the newest member is the worst
+        if len(self.heap) > 2 * len(self.members) + 16:
+            self.heap = [h for h in self.heap if self.entry.get(h[2]) == -h[1]]
+            heapq.heapify(self.heap)
+
+    def _worst(self):
+        while self.entry.get(self.heap[0][2]) != -self.heap[0][1]:  # drop stale entries
+            heapq.heappop(self.heap)
+        return self.heap[0]
+
+    def _add(self, key, value):
+        self.values_dict[key] = value
+        self.position[key] = len(self.members)
+        self.members.append(key)
+        self._push(key, value)
+        self.n_insert += 1
+
+    def _remove(self, key):
+        index = self.position.pop(key)
+        last = self.members.pop()
+        if index < len(self.members):  # move the last member into the free slot
+            self.members[index] = last
+            self.position[last] = index
+        del self.values_dict[key]
+        del self.entry[key]
+
+    def insert(self, key, value):
+        """Insert a single result, returns True if the key is a member afterwards."""
+        if key in self.values_dict:
+            self.values_dict[key] = value
+            self._push(key, value)
+            self.n_update += 1
+            return True
+        if len(self.members) < self.capacity:
+            self._add(key, value)
+            return True
+        score, _, worst_key = self._worst()
+        if self._score(value) > score:
+            heapq.heappop(self.heap)
+            self._remove(worst_key)
+            self.n_evict += 1
+            self._add(key, value)
+            return True
+        self.n_reject += 1
+        return False
+
+    def update(self, input_dict: dict):
+        """Merge a generation of results and return the number of new members that were admitted."""
+        new_keys = []
+        for k, v in input_dict.items():  # refresh existing members first, so the result is the top n of the union
+            if k in self.values_dict: self.insert(k, v)
+        for k, v in input_dict.items():
+            if k not in self.values_dict and self.insert(k, v): new_keys.append(k)
+        return sum([1 for k in new_keys if k in self.values_dict])
+
+    def churn(self):
+        """Returns (inserts, evictions, rejections, updates) since the last call and resets the counters."""
+        stats = self.n_insert, self.n_evict, self.n_reject, self.n_update
+        self.n_insert = self.n_evict = self.n_reject = self.n_update = 0
+        return stats
+
+    def sample(self, k=1):
+        return [self.members[random.randrange(len(self.members))] for _ in range(k)]
+
+    def tournament(self, k=2):
+        return max(self.sample(k), key=lambda key: self._score(self.values_dict[key]))
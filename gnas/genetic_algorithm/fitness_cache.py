@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+
+class FitnessCache(object):
+    """Bounded LRU of fitness results, valid only for the supernet weights they were measured on.
+
+    Entries are keyed by (evaluation name, individual) and tagged with the weight version at the time they were
+    stored. The version is bumped after every optimizer step, which invalidates all older entries.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.version = 0
+        self.n_hit = 0
+        self.n_miss = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __str__(self):
+        return "Fitness cache | size {:d} | hits {:d} | misses {:d} |".format(len(self.cache), self.n_hit,
+                                                                             self.n_miss)
+
+    def bump(self, *args):
+        self.version += 1
+
+    def register_optimizer(self, optimizer):
+        return optimizer.register_step_post_hook(self.bump)
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None or entry[0] != self.version:
+            self.n_miss += 1
+            return None
+        self.cache.move_to_end(key)
+        self.n_hit += 1
+        return entry[1]
+
+    def put(self, key, fitness):
+        self.cache[key] = (self.version, fitness)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
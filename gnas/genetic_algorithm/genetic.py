@@ -1,22 +1,45 @@
+import threading
 import numpy as np
 from random import choices
 from gnas.search_space.search_space import SearchSpace
 from gnas.search_space.cross_over import individual_uniform_crossover, individual_block_crossover
 from gnas.search_space.mutation import individual_flip_mutation
 from gnas.genetic_algorithm.ga_results import GenetricResult
-from gnas.genetic_algorithm.population_dict import PopulationDict
+from gnas.genetic_algorithm.elite_archive import EliteArchive
+from gnas.genetic_algorithm.population_engine import PopulationEngine, GenomeGeneration
 
 
 def genetic_algorithm_searcher(search_space: SearchSpace, generation_size=20, population_size=300, keep_size=0,
-                               min_objective=True, mutation_p=None, p_cross_over=None, cross_over_type='Bit'):
+                               min_objective=True, mutation_p=None, p_cross_over=None, cross_over_type='Bit',
+                               engine='Object', canonical=False, steady_state=False):
     if mutation_p is None: mutation_p = 1 / search_space.n_elements
     if p_cross_over is None: p_cross_over = 1
     print('p mutation:' + str(mutation_p), 1 / search_space.n_elements)
+    if engine == 'Array' and steady_state:
+        print("Steady state population engine")
+        return SteadyStateGeneticAlgorithms(PopulationEngine(search_space, mutation_p, p_cross_over, cross_over_type,
+                                                             canonical=canonical),
+                                            min_objective=min_objective, generation_size=generation_size,
+                                            population_size=population_size, keep_size=keep_size)
+    elif steady_state:
+        raise Exception('steady state mode requires the Array population engine')
+    elif engine == 'Array':
+        print("Array base population engine")
+        return ArrayGeneticAlgorithms(PopulationEngine(search_space, mutation_p, p_cross_over, cross_over_type,
+                                                       canonical=canonical),
+                                      min_objective=min_objective, generation_size=generation_size,
+                                      population_size=population_size, keep_size=keep_size)
+    elif engine != 'Object':
+        raise Exception('unkown population engine:' + str(engine))
 
     def population_initializer(p_size):
+        if canonical:
+            return [search_space.canonical_individual(ind) for ind in search_space.generate_population(p_size)]
         return search_space.generate_population(p_size)
 
     def mutation_function(x):
+        if canonical:
+            return search_space.canonical_individual(individual_flip_mutation(x, mutation_p))
         return individual_flip_mutation(x, mutation_p)
 
     if cross_over_type == 'Bit':
@@ -43,6 +66,8 @@ def genetic_algorithm_searcher(search_space: SearchSpace, generation_size=20, po
 
 
 class GeneticAlgorithms(object):
+    steady_state = False
+
     def __init__(self, population_initializer, mutation_function, cross_over_function, selection_function,
                  population_size=300, generation_size=20, keep_size=20, min_objective=False):
         ####################################################################
@@ -62,7 +87,7 @@ class GeneticAlgorithms(object):
         ####################################################################
         # status
         ####################################################################
-        self.max_dict = PopulationDict()
+        self.max_dict = EliteArchive(population_size, min_max=not min_objective)
         self.ga_result = GenetricResult()
         self.current_dict = dict()
 
@@ -104,25 +129,7 @@ class GeneticAlgorithms(object):
         f_var = np.var(generation_fitness)
         f_max = np.max(generation_fitness)
         f_min = np.min(generation_fitness)
-        total_dict = self.max_dict.copy()
-        total_dict.update(self.current_dict)
-        # last_dict = None
-        # if self.keep_size > 0:
-        #     last_dict = total_dict.filter_last_n(self.keep_size)
-        # if self.population_size - self.keep_size > 0:
-
-        best_max_dict = total_dict.filter_top_n(self.population_size,min_max=not self.min_objective)
-        n_diff = self.max_dict.get_n_diff(best_max_dict)
-        self.max_dict = best_max_dict
-        #
-        #     if self.keep_size > 0:
-        #         best_max_dict = best_max_dict.merge(last_dict)
-        # else:
-        #     best_max_dict = last_dict
-
-
-
-
+        n_diff = self._update_elite()
         self.current_dict = dict()
         population_fitness = np.asarray(list(self.max_dict.values())).flatten()
         population = np.asarray(list(self.max_dict.keys())).flatten()
@@ -141,8 +148,13 @@ class GeneticAlgorithms(object):
         print(
             "population results | mean fitness: {:5.2f} | var fitness {:5.2f} | max fitness: {:5.2f} | min fitness {:5.2f} |".format(
                 fp_mean, fp_var, fp_max, fp_min))
+        print("elite archive | inserts: {:d} | evictions: {:d} | rejections: {:d} | updates: {:d} |".format(
+            *self.max_dict.churn()))
         return f_mean, f_var, f_max, f_min, n_diff
 
+    def _update_elite(self):
+        return self.max_dict.update(self.current_dict)
+
     def get_current_generation(self):
         return self.generation
 
@@ -150,9 +162,113 @@ class GeneticAlgorithms(object):
         self.current_dict.update({individual: individual_fitness})
 
     def sample_child(self):
-        if len(list(self.max_dict.keys())) == 0: # if not population exist generate random indivaul
+        if len(self.max_dict) == 0: # if not population exist generate random indivaul
             return self.population_initializer(1)[0]
         else:
-            couples = choices(list(self.max_dict.keys()), k=2) # random select two indivuals from population
+            couples = self.max_dict.sample(2) # random select two indivuals from population
             child = self.cross_over_function(couples[0], couples[1]) # prefome cross over
             return self.mutation_function(child[0]) # select the first then mutation
+
+
+class ArrayGeneticAlgorithms(GeneticAlgorithms):
+    def __init__(self, engine: PopulationEngine, population_size=300, generation_size=20, keep_size=20,
+                 min_objective=False):
+        self.engine = engine
+        self.population_genomes = None
+        super(ArrayGeneticAlgorithms, self).__init__(
+            lambda p_size: GenomeGeneration(engine.random_genomes(p_size), engine), None, None, None,
+            population_size=population_size, generation_size=generation_size, keep_size=keep_size,
+            min_objective=min_objective)
+
+    def _create_new_generation(self, population, population_fitness):
+        p = population_fitness / np.nansum(population_fitness)
+        if self.min_objective: p = 1 - p
+        self.population_genomes = self.engine.to_genomes(population)
+        return GenomeGeneration(self.engine.new_generation(self.population_genomes, p, self.generation_size),
+                                self.engine)
+
+    def sample_child(self):
+        if self.population_genomes is None:  # if not population exist generate random indivaul
+            return self.engine.to_individual(self.engine.random_genomes(1)[0])
+        return self.engine.to_individual(self.engine.sample_child(self.population_genomes))
+
+
+class SteadyStateGeneration(object):
+    """Generation view of a steady state GA, each child is bred from the current elite on its first access."""
+
+    def __init__(self, ga, size):
+        self.ga = ga
+        self.children = [None] * size
+
+    def __len__(self):
+        return len(self.children)
+
+    def __getitem__(self, index):
+        if self.children[index] is None:
+            self.children[index] = self.ga.ask()
+        return self.children[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class SteadyStateGeneticAlgorithms(ArrayGeneticAlgorithms):
+    """Steady state GA without generation barriers.
+
+    Every fitness result is inserted into the elite archive at once, evicting the worst member, and ask() breeds
+    a new child from the current elite with binary tournament selection. All the methods are thread safe so many
+    evaluators can stream results in and pull candidates out. update_population only reports statistics of the
+    results received since the last call, it keeps the interface of the generational GA.
+    """
+    steady_state = True
+
+    def __init__(self, engine: PopulationEngine, population_size=300, generation_size=20, keep_size=20,
+                 min_objective=False):
+        self.lock = threading.RLock()
+        self.pending = set()  # candidates handed out without a fitness result
+        self.n_new = 0
+        super(SteadyStateGeneticAlgorithms, self).__init__(engine, population_size=population_size,
+                                                           generation_size=generation_size, keep_size=keep_size,
+                                                           min_objective=min_objective)
+
+    def _create_random_generation(self):
+        return SteadyStateGeneration(self, self.generation_size)
+
+    def _create_new_generation(self, population, population_fitness):
+        self.population_genomes = self.engine.to_genomes(population)
+        return SteadyStateGeneration(self, self.generation_size)
+
+    def _breed(self):
+        if len(self.max_dict) < self.population_size:  # random individuals until the elite is full
+            return self.engine.to_individual(self.engine.random_genomes(1)[0])
+        genomes = self.engine.to_genomes([self.max_dict.tournament(), self.max_dict.tournament()])
+        child, _ = self.engine.cross_over(genomes[0:1], genomes[1:2])
+        return self.engine.to_individual(self.engine.canonical_genomes(self.engine.mutation(child))[0])
+
+    def ask(self):
+        with self.lock:
+            # don't hand out a candidate that is being evaluated or already has a fitness, fall back to random
+            # candidates when the elite keeps breeding known ones
+            for i in range(100):
+                child = self._breed() if i < 10 else self.engine.to_individual(self.engine.random_genomes(1)[0])
+                if child not in self.pending and child not in self.max_dict and child not in self.current_dict:
+                    break
+            self.pending.add(child)
+            return child
+
+    def update_current_individual_fitness(self, individual, individual_fitness):
+        with self.lock:
+            self.current_dict.update({individual: individual_fitness})
+            self.pending.discard(individual)
+            is_new = individual not in self.max_dict
+            if self.max_dict.insert(individual, individual_fitness) and is_new: self.n_new += 1
+
+    def _update_elite(self):
+        n_diff = self.n_new
+        self.n_new = 0
+        return n_diff
+
+    def update_population(self):
+        with self.lock:
+            return super(SteadyStateGeneticAlgorithms, self).update_population()
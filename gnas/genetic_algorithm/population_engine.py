@@ -0,0 +1,97 @@
+import numpy as np
+from gnas.search_space.search_space import SearchSpace
+
+
+class PopulationEngine(object):
+    """Genetic operators over a whole generation stored as one 2-D genome matrix.
+
+    Each row is the concatenated code of an individual (the same layout as ``Individual.code`` and
+    ``MultipleBlockIndividual.code``). Selection, cross-over, mutation and deduplication run as batched
+    NumPy operations and follow the same distributions as the per-individual operators in
+    ``gnas.search_space.cross_over`` and ``gnas.search_space.mutation``.
+    """
+
+    def __init__(self, search_space: SearchSpace, mutation_p, p_cross_over, cross_over_type='Bit', canonical=False):
+        if cross_over_type not in ['Bit', 'Block']:
+            raise Exception('unkown cross over type:' + str(cross_over_type))
+        self.ss = search_space
+        self.mutation_p = mutation_p
+        self.p_cross_over = p_cross_over
+        self.cross_over_type = cross_over_type
+        self.canonical = canonical
+        self.max_values = search_space.max_values
+        self.gene_node = search_space.gene_node
+        self.n_nodes = len(search_space.node_offset)
+        self.n_genes = search_space.n_elements
+
+    def canonical_genomes(self, genomes):
+        return self.ss.canonical_genomes(genomes) if self.canonical else genomes
+
+    def random_genomes(self, n):
+        return self.canonical_genomes(self.ss.generate_genomes(n))
+
+    def selection(self, p, k):
+        p = np.asarray(p, dtype='float')
+        couples = np.random.choice(len(p), size=k, p=p / np.sum(p))
+        return np.reshape(couples, [-1, 2])
+
+    def cross_over(self, genomes_a, genomes_b):
+        n = genomes_a.shape[0]
+        if self.cross_over_type == 'Bit':
+            selection = np.random.randint(0, 2, [n, self.n_genes])
+        else:
+            selection = np.random.randint(0, 2, [n, self.n_nodes])[:, self.gene_node]
+        apply = np.random.rand(n, 1) < self.p_cross_over  # pairs that skip cross over keep their parents
+        selection = np.logical_or(selection, np.logical_not(apply))
+        return np.where(selection, genomes_a, genomes_b), np.where(selection, genomes_b, genomes_a)
+
+    def mutation(self, genomes):
+        flip = np.random.rand(*genomes.shape) < self.mutation_p
+        sign = np.where(np.random.rand(*genomes.shape) < 0.5, -1, 1)
+        new_genomes = genomes + flip * sign
+        new_genomes = np.where(new_genomes > self.max_values, 0, new_genomes)
+        return np.where(new_genomes < 0, self.max_values, new_genomes)
+
+    @staticmethod
+    def deduplicate(genomes):
+        _, idx = np.unique(genomes, axis=0, return_index=True)
+        return genomes[np.sort(idx)]
+
+    def new_generation(self, population_genomes, p, generation_size):
+        couples = self.selection(p, generation_size)  # selection
+        child_a, child_b = self.cross_over(population_genomes[couples[:, 0]],
+                                           population_genomes[couples[:, 1]])  # cross-over
+        child = np.stack([child_a, child_b], axis=1).reshape([-1, self.n_genes])
+        child = self.deduplicate(self.canonical_genomes(self.mutation(child)))  # mutation
+        if child.shape[0] < generation_size:
+            child = np.concatenate([child, self.random_genomes(generation_size - child.shape[0])], axis=0)
+        return child
+
+    def sample_child(self, population_genomes):
+        couples = np.random.randint(0, population_genomes.shape[0], 2)
+        child, _ = self.cross_over(population_genomes[couples[0:1]], population_genomes[couples[1:2]])
+        return self.canonical_genomes(self.mutation(child))[0]
+
+    def to_individual(self, genome):
+        return self.ss.genome_to_individual(genome)
+
+    def to_genomes(self, individual_list):
+        return np.stack([np.asarray(ind.code).astype('int') for ind in individual_list], axis=0)
+
+
+class GenomeGeneration(object):
+    """Sequence view over a genome matrix, individuals are decoded only when accessed."""
+
+    def __init__(self, genomes, engine: PopulationEngine):
+        self.genomes = genomes
+        self.engine = engine
+
+    def __len__(self):
+        return self.genomes.shape[0]
+
+    def __getitem__(self, index):
+        return self.engine.to_individual(self.genomes[index])
+
+    def __iter__(self):
+        for genome in self.genomes:
+            yield self.engine.to_individual(genome)
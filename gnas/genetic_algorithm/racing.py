@@ -0,0 +1,60 @@
+import numpy as np
+from statistics import NormalDist
+
+
+class RacingEvaluator(object):
+    """Racing evaluation of a generation over validation batches.
+
+    Every candidate is scored on a small slice of batches. After each round, candidates whose upper confidence
+    bound falls below the lower bound of the n_keep-th best are dropped, and the survivors get a larger budget
+    (multiplied by growth). The race stops when the top n_keep are separated from the rest, when no more than
+    n_keep candidates are left or when the whole validation set has been used.
+    """
+
+    def __init__(self, n_keep, confidence=0.95, initial_batches=2, growth=2, min_objective=False):
+        self.n_keep = n_keep
+        self.z = NormalDist().inv_cdf(confidence)
+        self.initial_batches = initial_batches
+        self.growth = growth
+        self.sign = -1 if min_objective else 1
+        self.batches = dict()  # number of batches consumed by each individual in the last race
+
+    def _bounds(self, alive, scores):
+        n = np.asarray([len(scores[i]) for i in alive])
+        mean = np.asarray([self.sign * np.mean(scores[i]) for i in alive])
+        dof = np.sum(n) - len(alive)
+        if dof <= 0:
+            return mean, None, None
+        # pooled variance of a single batch score
+        var = sum([np.sum((np.asarray(scores[i]) - np.mean(scores[i])) ** 2) for i in alive]) / dof
+        se = np.sqrt(var / n)
+        return mean, mean - self.z * se, mean + self.z * se
+
+    def race(self, individual_list, score_function, n_batches):
+        """score_function(individual, start, stop) returns the scores of batches [start, stop) of the individual,
+        batches are always requested in order."""
+        if self.n_keep >= len(individual_list):
+            raise Exception('racing needs more candidates than n_keep, got ' + str(len(individual_list)) +
+                            ' candidates for n_keep=' + str(self.n_keep))
+        scores = [[] for _ in individual_list]
+        alive = list(range(len(individual_list)))
+        budget = min(self.initial_batches, n_batches)
+        while True:
+            for i in alive:
+                if len(scores[i]) < budget:
+                    scores[i].extend(score_function(individual_list[i], len(scores[i]), budget))
+            if len(alive) <= self.n_keep or budget >= n_batches:
+                break
+            mean, lcb, ucb = self._bounds(alive, scores)
+            if lcb is not None:
+                kth_lcb = np.sort(lcb)[::-1][self.n_keep - 1]
+                keep = ucb >= kth_lcb  # drop candidates that at least n_keep others beat with confidence
+                alive, mean, lcb, ucb = [a for a, k in zip(alive, keep) if k], mean[keep], lcb[keep], ucb[keep]
+                if len(alive) <= self.n_keep:
+                    break
+                order = np.argsort(-mean)
+                if np.min(lcb[order[:self.n_keep]]) > np.max(ucb[order[self.n_keep:]]):
+                    break
+            budget = min(budget * self.growth, n_batches)
+        self.batches = {ind: len(s) for ind, s in zip(individual_list, scores)}
+        return [np.mean(s) for s in scores], [len(s) for s in scores]
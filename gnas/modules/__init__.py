@@ -1,2 +1,3 @@
 from gnas.modules.rnn_layer import RnnSearchModule
 from gnas.modules.cnn_block import CnnSearchModule
+from gnas.modules.node_module import add_created_parameters
@@ -0,0 +1,34 @@
+import random
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+
+def checkpoint_forward(module, function, *inputs):
+    """Runs function(*inputs) without keeping its activations, they are recomputed in backward.
+
+    Drop path draws its decisions from the python random module, which torch checkpointing doesn't restore,
+    so the recomputation replays the random state of the forward pass. Batch norm running statistics are restored
+    after the recomputation so they are updated once per batch.
+    """
+    random_state = random.getstate()
+    bn_list = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    state = {'recompute': False}
+
+    def run(*args):
+        if not state['recompute']:
+            state['recompute'] = True
+            return function(*args)
+        current_state = random.getstate()
+        random.setstate(random_state)  # the same drop path decisions as in the forward pass
+        buffers = [[b.clone() for b in m.buffers()] for m in bn_list]
+        try:
+            return function(*args)
+        finally:  # the recomputation can be stopped early with an exception
+            with torch.no_grad():
+                for m, saved in zip(bn_list, buffers):
+                    for b, s in zip(m.buffers(), saved):
+                        b.copy_(s)
+            random.setstate(current_state)
+
+    return checkpoint(run, *inputs, use_reentrant=False, preserve_rng_state=True)
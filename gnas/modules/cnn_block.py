@@ -4,18 +4,20 @@ import torch.nn as nn
 from torch.nn.parameter import Parameter
 from gnas.search_space.individual import Individual
 from gnas.modules.sub_graph_module import SubGraphModule
+from gnas.modules.checkpoint import checkpoint_forward
 from torch.nn import functional as F
 from modules.se_block import SEBlock
 from modules.identity import Identity
 
 
 class CnnSearchModule(nn.Module):
-    def __init__(self, n_channels, ss, individual_index=0, se_block=True):
+    def __init__(self, n_channels, ss, individual_index=0, se_block=True, checkpoint=False, lazy_ops=False):
         super(CnnSearchModule, self).__init__()
+        self.checkpoint = checkpoint  # recompute the sampled path in backward instead of storing its activations
 
         self.ss = ss
         self.n_channels = n_channels
-        self.config_dict = {'n_channels': n_channels}
+        self.config_dict = {'n_channels': n_channels, 'lazy_ops': lazy_ops}
         self.sub_graph_module = SubGraphModule(ss, self.config_dict,
                                                individual_index=individual_index)
         if ss.single_block:
@@ -45,18 +47,43 @@ class CnnSearchModule(nn.Module):
             w.data.uniform_(-stdv, stdv)
 
     def forward(self, inputs_tensor, bypass_input):
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint_forward(self, self.path_forward, inputs_tensor, bypass_input)
+        return self.path_forward(inputs_tensor, bypass_input)
+
+    def path_forward(self, inputs_tensor, bypass_input):
         if self.n_inputs == 1:
             net = self.sub_graph_module(inputs_tensor)
         elif self.n_inputs == 2:
             net = self.sub_graph_module(inputs_tensor, bypass_input)
 
-        net = torch.cat([net[i] for i in self.sub_graph_module.avg_index if i > 1], dim=1)
-        w = torch.cat([self.weights[i - 2] for i in self.sub_graph_module.avg_index if i > 1], dim=1)
-        net = self.bn(F.conv2d(self.relu(net), w, self.bias, 1, 0, 1, 1))
+        output_index = self.sub_graph_module.plan.output_index
+        if len(output_index) == 1:  # a single output needs no concatenation
+            net = net[output_index[0]]
+        else:
+            net = torch.cat([net[i] for i in output_index], dim=1)
+        net = self.bn(F.conv2d(self.relu(net), self.output_weight(), self.bias, 1, 0, 1, 1))
         return self.se_block(net) + inputs_tensor
 
+    def output_weight(self):
+        plan = self.sub_graph_module.plan
+        if len(self.w_list) == 1:
+            return self.w_list[0]
+        if torch.is_grad_enabled():
+            return torch.cat(self.w_list, dim=1)
+        # without autograd the slices are copied into a buffer of the plan, the weights can change in place at any
+        # time (optimizer steps, shared memory updates) so the copy is not reused
+        w = self.w_list[0]
+        if plan.w_cat is None or plan.w_cat.device != w.device or plan.w_cat.dtype != w.dtype:
+            plan.w_cat = w.new_empty([w.shape[0], w.shape[1] * len(self.w_list), *w.shape[2:]])
+        return torch.cat(self.w_list, dim=1, out=plan.w_cat)
+
     def set_individual(self, individual: Individual):
         self.sub_graph_module.set_individual(individual)
+        plan = self.sub_graph_module.plan
+        if plan.w_list is None:
+            plan.w_list = [self.weights[i - 2] for i in plan.output_index]  # 1x1 weight slices
+        self.w_list = plan.w_list
 
     def parameters(self):
         for name, param in self.named_parameters():
@@ -0,0 +1,53 @@
+import warnings
+import torch
+from torch import nn
+
+__nl_code__ = {nn.Tanh: 'torch.tanh({})',
+               nn.ReLU: 'torch.relu({})',
+               nn.ReLU6: 'torch.nn.functional.relu6({})',
+               nn.SELU: 'torch.selu({})',
+               nn.Sigmoid: 'torch.sigmoid({})'}
+
+
+def _non_linear_code(non_linear, value):
+    if isinstance(non_linear, nn.LeakyReLU):
+        return 'torch.nn.functional.leaky_relu({}, {})'.format(value, float(non_linear.negative_slope))
+    code = __nl_code__.get(type(non_linear))
+    if code is None:
+        raise Exception('unkown non linear for a compiled cell:' + str(non_linear))
+    return code.format(value)
+
+
+def _node_name(index):
+    if index == 0:
+        raise Exception('a compiled cell only supports nodes that read the state or other nodes')
+    return 'state' if index == 1 else 'n' + str(index)
+
+
+def generate_cell_code(sub_graph_module):
+    """TorchScript source of the whole bptt loop for the individual currently set in the RNN sub graph."""
+    input_node, node_list = sub_graph_module.block_modules[0], sub_graph_module.block_modules[1:]
+    lines = ['def rnn_loop(x_proj: Tensor, state: Tensor, w_h: Tensor, b_h: Tensor, weights: List[Tensor],',
+             '             biases: List[Tensor]) -> Tuple[Tensor, Tensor]:',
+             '    outputs = []',
+             '    for t in range(x_proj.size(0)):',
+             '        x_g = x_proj[t].chunk(2, -1)',
+             '        h_g = torch.nn.functional.linear(state, w_h, b_h).chunk(2, -1)',
+             '        c = torch.sigmoid(x_g[0] + h_g[0])',
+             '        n2 = c * {} + (1 - c) * state'.format(_non_linear_code(input_node.non_linear, 'x_g[1] + h_g[1]'))]
+    for i, nm in enumerate(node_list):
+        x = _node_name(nm.select_index)
+        lines += ['        g = torch.nn.functional.linear({}, weights[{}], biases[{}]).chunk(2, -1)'.format(x, i, i),
+                  '        c = torch.sigmoid(g[0])',
+                  '        n{} = c * {} + (1 - c) * {}'.format(i + 3, _non_linear_code(nm.non_linear, 'g[1]'), x)]
+    output = ', '.join([_node_name(i) for i in sub_graph_module.plan.avg_index])
+    lines += ['        state = torch.mean(torch.stack([{}], -1), -1)'.format(output),
+              '        outputs.append(state)',
+              '    return torch.stack(outputs, 0), state']
+    return '\n'.join(lines) + '\n'
+
+
+def compile_cell(sub_graph_module):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)  # TorchScript is deprecated in recent torch versions
+        return torch.jit.CompilationUnit(generate_cell_code(sub_graph_module)).rnn_loop
@@ -0,0 +1,31 @@
+import copy
+from collections import OrderedDict
+from gnas.modules.sub_graph_module import SubGraphModule
+from gnas.modules.rnn_layer import RnnSearchModule
+from modules.drop_module import DropModule
+from modules.weight_drop import WeightDrop
+
+
+def export_network(model, individual):
+    """Returns a copy of the supernet that only holds the operations selected by the individual.
+
+    Every SubGraphModule is replaced by a FixedSubGraphModule with the trained weights of the selected path, the
+    rest of the model is copied as is. The search space and the drop path control stay shared with the supernet,
+    so enabling drop path still reaches the exported network.
+    """
+    model.set_individual(individual)
+    memo = dict()
+    for m in model.modules():
+        if isinstance(m, SubGraphModule):
+            memo[id(m.ss)] = m.ss
+        elif isinstance(m, RnnSearchModule):
+            memo[id(m.cell_cache)] = OrderedDict()  # compiled cells can't be copied, the copy compiles its own
+        elif isinstance(m, DropModule):
+            memo[id(m.drop_control)] = m.drop_control
+        elif isinstance(m, WeightDrop):
+            for name_w in m.weights:
+                m.module.__dict__.pop(name_w, None)  # dropped weight of the last forward, rebuilt on every forward
+    for m in list(model.modules()):
+        if isinstance(m, SubGraphModule):
+            memo[id(m)] = m.export(memo)
+    return copy.deepcopy(model, memo)
@@ -1,7 +1,10 @@
+import copy
+import torch
 import torch.nn as nn
+from torch.nn import functional as F
 from gnas.modules.module_generator import generate_non_linear, generate_op
 from modules.weight_drop import WeightDrop
-from modules.drop_module import DropModule
+from modules.drop_module import DropModule, drop_path_sum
 
 
 class RnnInputNodeModule(nn.Module):
@@ -24,18 +27,51 @@ class RnnInputNodeModule(nn.Module):
 
         self.non_linear = None
         self.node_config = None
+        self.h_weights = None
 
     def forward(self, inputs):
-        c = self.sigmoid(self.x_linear_list[0](inputs[0]) + self.h_linear_list[0](inputs[1]))
-        output = c * self.non_linear(self.x_linear_list[1](inputs[0]) + self.h_linear_list[1](inputs[1])) + (1 - c) * \
-                 inputs[1]
-        return output
+        self.resample_weights()  # a single step, new masks on every call like WeightDrop.forward
+        return self.step(self.project_input(inputs[0]), inputs[1])
+
+    def resample_weights(self):
+        # masked state projections, kept until the next call so a whole sequence shares the same masks
+        for l in self.h_linear_list:
+            l._setweights()
+        self.h_weights = (torch.cat([l.module.weight for l in self.h_linear_list], dim=0),
+                          torch.cat([l.module.bias for l in self.h_linear_list], dim=0))
+        return self.h_weights
+
+    def project_input(self, x):
+        # both input projections in one GEMM, x can be a single step or the whole [T,B,F] sequence
+        w = torch.cat([l.weight for l in self.x_linear_list], dim=0)
+        b = torch.cat([l.bias for l in self.x_linear_list], dim=0)
+        return F.linear(x, w, b)
+
+    def step(self, x_proj, h):
+        w, b = self.h_weights
+        x_c, x_n = torch.chunk(x_proj, 2, dim=-1)
+        h_c, h_n = torch.chunk(F.linear(h, w, b), 2, dim=-1)
+        c = self.sigmoid(x_c + h_c)
+        return c * self.non_linear(x_n + h_n) + (1 - c) * h
 
     def set_current_node_config(self, current_config):
         nl_index = current_config
         self.cc = current_config
         self.non_linear = self.nl_module[nl_index]
 
+    def node_state(self):
+        return self.cc, self.non_linear
+
+    def load_node_state(self, state):
+        self.cc, self.non_linear = state
+
+    def active_parameters(self):
+        return list(self.parameters())  # every projection is used by all the configurations
+
+    def export(self, memo):
+        self.h_weights = None  # resampled by the copy
+        return copy.deepcopy(self, memo)  # nothing to prune, only the non linearity is selected
+
 
 class RnnNodeModule(nn.Module):
     def __init__(self, node_config, config_dict):
@@ -55,11 +91,26 @@ class RnnNodeModule(nn.Module):
         # self.bn = nn.BatchNorm1d(self.n_channels)
         self.non_linear = None
         self.node_config = None
+        self.active_params = list(self.parameters())
 
-    def forward(self, inputs):
+    def forward(self, inputs, weights=None):
+        # gate and candidate projections of the selected input in one GEMM
         x = inputs[self.select_index]
-        c = self.sigmoid(self.x_linear(x))
-        return c * self.non_linear(self.h_linear(x)) + (1 - c) * x
+        w, b = self.fused_weights() if weights is None else weights
+        c, h = torch.chunk(F.linear(x, w, b), 2, dim=-1)
+        c = self.sigmoid(c)
+        return c * self.non_linear(h) + (1 - c) * x
+
+    def fused_weights(self):
+        return (torch.cat([self.x_linear.weight, self.h_linear.weight], dim=0),
+                torch.cat([self.x_linear.bias, self.h_linear.bias], dim=0))
+
+    def stacked_weights(self):
+        # fused weights of every input choice, [n_inputs, 2 * n_channels, n_channels]
+        return (torch.stack([torch.cat([x.weight, h.weight], dim=0) for x, h in
+                             zip(self.x_linear_list, self.h_linear_list)], dim=0),
+                torch.stack([torch.cat([x.bias, h.bias], dim=0) for x, h in
+                             zip(self.x_linear_list, self.h_linear_list)], dim=0))
 
     def set_current_node_config(self, current_config):
         self.select_index, op_index, nl_index = current_config
@@ -67,6 +118,21 @@ class RnnNodeModule(nn.Module):
         self.non_linear = self.nl_module[nl_index]
         self.x_linear = self.x_linear_list[op_index]
         self.h_linear = self.h_linear_list[op_index]
+        self.active_params = [*self.x_linear.parameters(), *self.h_linear.parameters()]
+
+    def node_state(self):
+        return self.cc, self.non_linear, self.x_linear, self.h_linear, self.active_params
+
+    def load_node_state(self, state):
+        self.cc, self.non_linear, self.x_linear, self.h_linear, self.active_params = state
+        self.select_index = self.cc[0]
+
+    def active_parameters(self):
+        return self.active_params
+
+    def export(self, memo):
+        return FixedRnnNodeModule(self.select_index, copy.deepcopy(self.x_linear, memo),
+                                  copy.deepcopy(self.h_linear, memo), copy.deepcopy(self.non_linear, memo))
 
 
 class ConvNodeModule(nn.Module):
@@ -75,12 +141,19 @@ class ConvNodeModule(nn.Module):
         self.nc = node_config
 
         self.n_channels = config_dict.get('n_channels')
-        self.conv_module = []
-        for j in range(node_config.get_n_inputs()):
-            op_list = [DropModule(op, node_config.drop_path_control) for op in
-                       generate_op(self.nc.op_list, self.n_channels, self.n_channels)]
+        self.lazy = config_dict.get('lazy_ops', False)  # build an op the first time it is selected
+        self.seed = (torch.initial_seed(), node_config.node_id)  # Net makes it unique per node, see set_lazy_seed
+        self.probe = torch.zeros(0)  # follows the device and dtype of the module for the lazily built ops
+        self.created_params = []  # parameters of lazily built ops that the optimizer doesn't know yet
+        self.conv_module = []  # [weight slot][op], a slot per input unless the node shares the op weights
+        for j in range(node_config.get_n_weight_slots()):
+            if self.lazy:
+                op_list = [None] * len(self.nc.op_list)
+            else:
+                op_list = [DropModule(op, node_config.drop_path_control) for op in
+                           generate_op(self.nc.op_list, self.n_channels, self.n_channels)]
             self.conv_module.append(op_list)
-            [self.add_module('conv_op_' + str(i) + '_in_' + str(j), m) for i, m in enumerate(self.conv_module[-1])]
+            [self.add_module(self.op_name(j, i), m) for i, m in enumerate(self.conv_module[-1]) if m is not None]
 
         self.non_linear_a = None
         self.non_linear_b = None
@@ -89,11 +162,13 @@ class ConvNodeModule(nn.Module):
         self.cc = None
         self.op_a = None
         self.op_b = None
+        self.active_ops = None
+        self.active_params = list(self.parameters())
 
     def forward(self, inputs):
         net_a = inputs[self.input_a]
         net_b = inputs[self.input_b]
-        return self.op_a(net_a) + self.op_b(net_b)
+        return drop_path_sum(self.op_a, net_a, self.op_b, net_b)
 
     def set_current_node_config(self, current_config):
         input_a, input_b, input_index_a, input_index_b, op_a, op_b = current_config
@@ -101,13 +176,128 @@ class ConvNodeModule(nn.Module):
         self.cc = current_config
         self.input_a = input_a
         self.input_b = input_b
-        self.op_a = self.conv_module[input_index_a][op_a]
-        self.op_b = self.conv_module[input_index_b][op_b]
-        #### set grad false
-        for p in self.parameters():
+        # plain attributes, registering them would add the selected ops to the state dict a second time
+        object.__setattr__(self, 'op_a', self.get_op(self.nc.weight_slot(input_index_a, 0), op_a))
+        object.__setattr__(self, 'op_b', self.get_op(self.nc.weight_slot(input_index_b, 1), op_b))
+        active_ops = [self.op_a] if self.op_a is self.op_b else [self.op_a, self.op_b]
+        self.set_active(active_ops, [p for op in active_ops for p in op.parameters()])
+
+    def set_active(self, active_ops, active_params):
+        #### set grad false, after the first call only the previous path is switched off
+        for p in (self.parameters() if self.active_ops is None else self.active_params):
             p.requires_grad = False
         #### set grad true
-        for p in self.op_b.parameters():
-            p.requires_grad = True
-        for p in self.op_a.parameters():
+        self.active_ops = active_ops
+        self.active_params = active_params
+        for p in self.active_params:
             p.requires_grad = True
+
+    def node_state(self):
+        return self.cc, self.op_a, self.op_b, self.active_ops, self.active_params
+
+    def load_node_state(self, state):
+        # the ops and parameters resolved by set_current_node_config for the same config
+        cc, op_a, op_b, active_ops, active_params = state
+        self.cc = cc
+        self.input_a, self.input_b = cc[0], cc[1]
+        self.select_index = [self.input_a, self.input_b]
+        object.__setattr__(self, 'op_a', op_a)
+        object.__setattr__(self, 'op_b', op_b)
+        self.set_active(active_ops, active_params)
+
+    def active_parameters(self):
+        return self.active_params
+
+    def set_lazy_seed(self, seed):
+        self.seed = (torch.initial_seed(), seed)
+
+    def op_name(self, slot, op_index):
+        if self.nc.op_sharing == 'None':
+            return 'conv_op_' + str(op_index) + '_in_' + str(slot)
+        elif self.nc.op_sharing == 'Input':
+            return 'conv_op_' + str(op_index) + '_branch_' + str(slot)
+        return 'conv_op_' + str(op_index)
+
+    def get_op(self, slot, op_index):
+        op = self.conv_module[slot][op_index]
+        if op is None:
+            with torch.random.fork_rng(devices=[]):  # the same initialization whenever the op is first selected
+                torch.manual_seed(hash((*self.seed, slot, op_index)) % (2 ** 62))
+                op = generate_op([self.nc.op_list[op_index]], self.n_channels, self.n_channels)[0]
+                for p in op.parameters():
+                    if len(p.shape) == 4:
+                        nn.init.kaiming_normal_(p)  # like Net.reset_param
+            op = DropModule(op, self.nc.drop_path_control).to(device=self.probe.device, dtype=self.probe.dtype)
+            op.train(self.training)
+            self.conv_module[slot][op_index] = op
+            self.add_module(self.op_name(slot, op_index), op)
+            self.created_params.extend(op.parameters())
+        return op
+
+    def _apply(self, fn, *args, **kwargs):
+        self.probe = fn(self.probe)
+        return super(ConvNodeModule, self)._apply(fn, *args, **kwargs)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints from before op_a/op_b were plain attributes hold the selected ops a second time
+        for k in [k for k in state_dict if k.startswith(prefix + 'op_a.') or k.startswith(prefix + 'op_b.')]:
+            del state_dict[k]
+        # build the lazy ops that the checkpoint holds so their weights are loaded
+        for j, op_list in enumerate(self.conv_module):
+            for i, op in enumerate(op_list):
+                name = prefix + self.op_name(j, i) + '.'
+                if op is None and any([k.startswith(name) for k in state_dict]):
+                    self.get_op(j, i)
+        super(ConvNodeModule, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def export(self, memo):
+        return FixedConvNodeModule(self.input_a, self.input_b, copy.deepcopy(self.op_a, memo),
+                                   copy.deepcopy(self.op_b, memo))
+
+
+class FixedRnnNodeModule(nn.Module):
+    """RnnNodeModule pruned to the selected input and projections."""
+
+    def __init__(self, select_index, x_linear, h_linear, non_linear):
+        super(FixedRnnNodeModule, self).__init__()
+        self.select_index = select_index
+        self.x_linear = x_linear
+        self.h_linear = h_linear
+        self.non_linear = non_linear
+        self.sigmoid = nn.Sigmoid()
+
+    def forward(self, inputs, weights=None):
+        x = inputs[self.select_index]
+        w, b = self.fused_weights() if weights is None else weights
+        c, h = torch.chunk(F.linear(x, w, b), 2, dim=-1)
+        c = self.sigmoid(c)
+        return c * self.non_linear(h) + (1 - c) * x
+
+    def fused_weights(self):
+        return (torch.cat([self.x_linear.weight, self.h_linear.weight], dim=0),
+                torch.cat([self.x_linear.bias, self.h_linear.bias], dim=0))
+
+
+class FixedConvNodeModule(nn.Module):
+    """ConvNodeModule pruned to the two selected operations."""
+
+    def __init__(self, input_a, input_b, op_a, op_b):
+        super(FixedConvNodeModule, self).__init__()
+        self.input_a = input_a
+        self.input_b = input_b
+        self.op_a = op_a
+        self.op_b = op_b
+
+    def forward(self, inputs):
+        return drop_path_sum(self.op_a, inputs[self.input_a], self.op_b, inputs[self.input_b])
+
+
+def add_created_parameters(optimizer, model):
+    """Adds the parameters of the ops that were built lazily since the last call to the (single) parameter group of
+    the optimizer."""
+    for m in model.modules():
+        if isinstance(m, ConvNodeModule) and len(m.created_params) > 0:
+            params = optimizer.param_groups[0]['params']
+            known = set([id(p) for p in params])  # the optimizer may have been built after the ops
+            params.extend([p for p in m.created_params if id(p) not in known])
+            m.created_params = []
@@ -1,12 +1,53 @@
 import torch
 import torch.nn as nn
+from torch.nn import functional as F
+from collections import OrderedDict
 
 from gnas.search_space.individual import Individual
 from gnas.modules.sub_graph_module import SubGraphModule
+from gnas.modules.compiled_cell import compile_cell
+
+
+def _non_linear_groups(nl_module, nl_index):
+    # individuals grouped by their non linearity, (module, individual index tensor)
+    nl_index = torch.tensor(nl_index, dtype=torch.long)
+    return [(nl_module[i], (nl_index == i).nonzero().view(-1)) for i in torch.unique(nl_index).tolist()]
+
+
+def _apply_non_linear(x, groups):
+    if len(groups) == 1:
+        return groups[0][0](x)
+    output = torch.empty_like(x)
+    for nl, index in groups:
+        output[index] = nl(x[index])
+    return output
+
+
+class MultiIndividualPlan(object):
+    """Per node input selection, weight choice and non linearity of a list of individuals."""
+
+    def __init__(self, sub_graph_module, individual_list, device):
+        plan_list = []
+        for ind in individual_list:
+            sub_graph_module.set_individual(ind)
+            plan_list.append(sub_graph_module.plan)
+        input_node, node_list = sub_graph_module.block_modules[0], sub_graph_module.block_modules[1:]
+        self.n_individuals = len(plan_list)
+        self.individual_index = torch.arange(self.n_individuals, device=device)
+        self.input_groups = _non_linear_groups(input_node.nl_module, [p.node_config[0] for p in plan_list])
+        self.select_index, self.op_index, self.node_groups = [], [], []
+        for j, nm in enumerate(node_list):
+            config = [p.node_config[j + 1] for p in plan_list]
+            self.select_index.append(torch.tensor([c[0] for c in config], dtype=torch.long, device=device))
+            self.op_index.append(torch.tensor([c[1] for c in config], dtype=torch.long, device=device))
+            self.node_groups.append(_non_linear_groups(nm.nl_module, [c[2] for c in config]))
+        self.avg_weight = torch.zeros(len(node_list) + 3, self.n_individuals, device=device)
+        for i, p in enumerate(plan_list):
+            self.avg_weight[p.avg_index, i] = 1.0 / len(p.avg_index)
 
 
 class RnnSearchModule(nn.Module):
-    def __init__(self, in_channels, n_channels, working_device, ss):
+    def __init__(self, in_channels, n_channels, working_device, ss, compiled=False, cell_cache_size=16):
         super(RnnSearchModule, self).__init__()
 
         self.ss = ss
@@ -16,43 +57,93 @@ class RnnSearchModule(nn.Module):
         self.config_dict = {'in_channels': self.in_channels,
                             'n_channels': self.n_channels}
         self.sub_graph_module = SubGraphModule(ss, self.config_dict)
+        self.compiled = compiled  # run the time loop in a TorchScript function generated for each individual
+        self.cell_cache_size = cell_cache_size
+        self.cell_cache = OrderedDict()  # genome key -> compiled loop, least recently used first
+        self.multi_plan = None
 
         self.reset_parameters()
 
     def forward(self, inputs_tensor, state_tensor):
         # input size [Time step,Batch,features]
+        if self.multi_plan is not None:
+            return self.multi_forward(inputs_tensor, state_tensor)
+        input_node, node_list = self.sub_graph_module.block_modules[0], self.sub_graph_module.block_modules[1:]
+        x_proj = input_node.project_input(inputs_tensor)  # input projections of all the time steps in one GEMM
+        input_node.resample_weights()  # one weight drop mask per sequence
+        weights = [nm.fused_weights() for nm in node_list]  # concatenated once per sequence
+        if self.compiled:
+            return self.compiled_forward(x_proj, state_tensor, input_node, weights)
 
         state = state_tensor[0, :, :]
         outputs = []
-
-        for i in torch.split(inputs_tensor, split_size_or_sections=1, dim=0):  # Loop over time steps
-            output, state = self.cell(i, state)
-            # state_norm = state.norm(dim=-1)
-            # max_norm = 25.0
-            # if torch.any(state_norm > max_norm).item():
-            #     clip_select = state_norm > max_norm
-            #     clip_norms = state_norm[clip_select]
-            #
-            #     mask = torch.ones(state.size(), device=self.working_device)
-            #     normalizer = max_norm / clip_norms
-            #     mask[clip_select, :] = normalizer.unsqueeze(dim=-1)
-            #     mask = mask.detach()
-            #     state *= mask
-                # print(np.max(state.norm(dim=-1).detach().cpu().numpy()))
-                # print("Max Norm pass")
-            # state = state / state.norm(dim=-1)
+        for x, x_p in zip(torch.unbind(inputs_tensor, dim=0), torch.unbind(x_proj, dim=0)):  # Loop over time steps
+            output, state = self.cell(x, x_p, state, input_node, node_list, weights)
             outputs.append(output)
         output = torch.stack(outputs, dim=0)
 
         return output, state.unsqueeze(dim=0)
 
-    def cell(self, x, state):
-        net = self.sub_graph_module(x.squeeze(dim=0), state)
-        output, state = torch.mean(torch.stack([net[i] for i in self.sub_graph_module.avg_index], dim=-1), dim=-1), net[
-            -1]
+    def cell(self, x, x_proj, state, input_node, node_list, weights):
+        net = [x, state, input_node.step(x_proj, state)]
+        for nm, w in zip(node_list, weights):
+            net.append(nm(net, w))
+        avg_index = self.sub_graph_module.plan.avg_index
+        output = torch.mean(torch.stack([net[i] for i in avg_index], dim=-1), dim=-1)
         return output, output
 
+    def compiled_forward(self, x_proj, state_tensor, input_node, weights):
+        key = self.sub_graph_module.individual.key
+        rnn_loop = self.cell_cache.get(key)
+        if rnn_loop is None:
+            rnn_loop = self.cell_cache[key] = compile_cell(self.sub_graph_module)
+            if len(self.cell_cache) > self.cell_cache_size:
+                self.cell_cache.popitem(last=False)
+        else:
+            self.cell_cache.move_to_end(key)
+        w_h, b_h = input_node.h_weights
+        output, state = rnn_loop(x_proj, state_tensor[0, :, :], w_h, b_h, [w for w, _ in weights],
+                                 [b for _, b in weights])
+        return output, state.unsqueeze(dim=0)
+
+    def multi_forward(self, inputs_tensor, state_tensor):
+        # state size [1,Individuals x Batch,features], the inputs are shared by all the individuals
+        plan = self.multi_plan
+        input_node, node_list = self.sub_graph_module.block_modules[0], self.sub_graph_module.block_modules[1:]
+        x_proj = input_node.project_input(inputs_tensor)
+        w_h, b_h = input_node.resample_weights()
+        weights = []
+        for nm, op_index in zip(node_list, plan.op_index):
+            w, b = nm.stacked_weights()
+            weights.append((w[op_index].transpose(1, 2), b[op_index].unsqueeze(dim=1)))  # [G,n,2n], [G,1,2n]
+
+        state = state_tensor[0, :, :].view(plan.n_individuals, -1, self.n_channels)
+        outputs = []
+        for x_p in torch.unbind(x_proj, dim=0):  # Loop over time steps
+            net = state.new_empty(len(node_list) + 3, *state.shape)  # node outputs of all the individuals
+            net[0] = 0  # never selected, zeroed so the average over the nodes stays finite
+            net[1] = state
+            x_c, x_n = torch.chunk(x_p, 2, dim=-1)
+            h_c, h_n = torch.chunk(F.linear(state, w_h, b_h), 2, dim=-1)
+            c = torch.sigmoid(x_c + h_c)
+            net[2] = c * _apply_non_linear(x_n + h_n, plan.input_groups) + (1 - c) * state
+            for j, ((w, b), select_index, groups) in enumerate(zip(weights, plan.select_index, plan.node_groups)):
+                x = net[select_index, plan.individual_index]
+                g_c, g_n = torch.chunk(torch.baddbmm(b, x, w), 2, dim=-1)
+                c = torch.sigmoid(g_c)
+                net[j + 3] = c * _apply_non_linear(g_n, groups) + (1 - c) * x
+            state = torch.einsum('kg,kgbn->gbn', plan.avg_weight, net)
+            outputs.append(state)
+        output = torch.stack(outputs, dim=0)
+        return output.view(output.shape[0], -1, self.n_channels), state.view(1, -1, self.n_channels)
+
+    def set_individual_list(self, individual_list):
+        """Runs all the individuals at once, the state batch holds one block of the batch per individual."""
+        self.multi_plan = MultiIndividualPlan(self.sub_graph_module, individual_list,
+                                              next(self.parameters()).device)
+
     def set_individual(self, individual: Individual):
+        self.multi_plan = None
         self.sub_graph_module.set_individual(individual)
 
     def init_state(self, batch_size=1):  # model init state
@@ -1,12 +1,26 @@
 import torch
 import torch.nn as nn
 import numpy as np
+from collections import OrderedDict
 from gnas.search_space.individual import Individual
 from gnas.modules.operation_factory import get_module
 
 
+class ExecutionPlan(object):
+    """Everything set_individual derives from a genome, compiled once per individual."""
+    __slots__ = ['node_config', 'avg_index', 'output_index', 'node_state', 'w_list', 'w_cat']
+
+    def __init__(self, node_config, avg_index, node_state=None):
+        self.node_config = node_config
+        self.avg_index = avg_index  # nodes whose output is not used by another node
+        self.output_index = [int(i) for i in avg_index if i > 1]  # the same without the block inputs
+        self.node_state = node_state  # resolved ops and parameters of every node, applied on a cache hit
+        self.w_list = None  # owner data, the 1x1 weight slices of CnnSearchModule and a buffer to concatenate them
+        self.w_cat = None
+
+
 class SubGraphModule(nn.Module):
-    def __init__(self, search_space, config_dict, individual_index=0):
+    def __init__(self, search_space, config_dict, individual_index=0, plan_cache_size=128):
         super(SubGraphModule, self).__init__()
         self.ss = search_space
         self.config_dict = config_dict
@@ -18,6 +32,11 @@ class SubGraphModule(nn.Module):
                                   self.ss.ocl[individual_index]]
         #
         [self.add_module('Node' + str(i), n) for i, n in enumerate(self.block_modules)]
+        self.plan_cache_size = plan_cache_size
+        self.plan_cache = OrderedDict()  # genome key -> ExecutionPlan, least recently used first
+        self.plan = None
+        self.avg_index = None
+        self.individual = None
 
     def forward(self, *input_list):
         # input list at start is h_n and h_(n-1)
@@ -26,20 +45,70 @@ class SubGraphModule(nn.Module):
             net.append(nm(net))  # call each block in the sub graph
         return net  # output list of all block in the sub graph
 
-    def set_individual(self, individual: Individual):
-        if not self.ss.single_block:
-            individual = individual.get_individual(self.individual_index)
+    def compile_plan(self, individual: Individual):
+        node_config = individual.generate_node_config()
         si_list = []
-        for nc, nm in zip(individual.generate_node_config(), self.block_modules):
+        for nc, nm in zip(node_config, self.block_modules):
             nm.set_current_node_config(nc)
             if nm.__dict__.get('select_index') is not None:
                 si_list.append(nm.select_index)
 
         current_node_list = np.unique(si_list)
         if self.ss.single_block:
-            self.avg_index = np.asarray([n.node_id for n in self.ss.ocl if n.node_id not in current_node_list]).astype(
+            avg_index = np.asarray([n.node_id for n in self.ss.ocl if n.node_id not in current_node_list]).astype(
                 'int')
         else:
-            self.avg_index = np.asarray(
+            avg_index = np.asarray(
                 [n.node_id for n in self.ss.ocl[self.individual_index] if n.node_id not in current_node_list]).astype(
                 'int')
+        return ExecutionPlan(node_config, avg_index, [nm.node_state() for nm in self.block_modules])
+
+    def set_individual(self, individual: Individual):
+        if not self.ss.single_block:
+            individual = individual.get_individual(self.individual_index)
+        plan = self.plan_cache.get(individual.key)
+        if plan is None:
+            plan = self.compile_plan(individual)  # also configures the nodes
+            self.plan_cache[individual.key] = plan
+            if len(self.plan_cache) > self.plan_cache_size:
+                self.plan_cache.popitem(last=False)
+        else:
+            self.plan_cache.move_to_end(individual.key)
+            for state, nm in zip(plan.node_state, self.block_modules):
+                nm.load_node_state(state)
+        self.plan = plan
+        self.avg_index = plan.avg_index
+        self.individual = individual
+
+    def export(self, memo):
+        if self.individual is None:
+            raise Exception('set an individual before exporting the sub graph')
+        return FixedSubGraphModule(self.ss, self.individual, self.individual_index,
+                                   [nm.export(memo) for nm in self.block_modules],
+                                   ExecutionPlan(self.plan.node_config, self.plan.avg_index))  # no supernet ops
+
+
+class FixedSubGraphModule(nn.Module):
+    """SubGraphModule of a single individual that holds only the selected operations."""
+
+    def __init__(self, search_space, individual: Individual, individual_index, block_modules, plan):
+        super(FixedSubGraphModule, self).__init__()
+        self.ss = search_space
+        self.individual = individual
+        self.individual_index = individual_index
+        self.block_modules = block_modules
+        [self.add_module('Node' + str(i), n) for i, n in enumerate(self.block_modules)]
+        self.plan = plan
+        self.avg_index = plan.avg_index
+
+    def forward(self, *input_list):
+        net = list(input_list)
+        for nm in self.block_modules:
+            net.append(nm(net))
+        return net
+
+    def set_individual(self, individual: Individual):
+        if not self.ss.single_block:
+            individual = individual.get_individual(self.individual_index)
+        if individual.key != self.individual.key:
+            raise Exception('exported sub graph only supports the individual it was exported with')
@@ -13,34 +13,36 @@ class SearchSpaceType(Enum):
     CNNTripleCell = 2
 
 
-def _two_input_cell(n_nodes, drop_path_control):
-    node_config_list = [CnnNodeConfig(2, [0, 1], CNN_OP, drop_path_control=drop_path_control)]
+def _two_input_cell(n_nodes, drop_path_control, op_sharing):
+    node_config_list = [CnnNodeConfig(2, [0, 1], CNN_OP, drop_path_control=drop_path_control, op_sharing=op_sharing)]
     for i in range(n_nodes - 1):
         node_config_list.append(
             CnnNodeConfig(3 + i, list(np.linspace(0, 2 + i, 3 + i).astype('int')), CNN_OP,
-                          drop_path_control=drop_path_control))
+                          drop_path_control=drop_path_control, op_sharing=op_sharing))
     return node_config_list
 
 
-def _one_input_cell(n_nodes, drop_path_control):
-    node_config_list = [CnnNodeConfig(1, [0], CNN_OP, drop_path_control=drop_path_control)]
+def _one_input_cell(n_nodes, drop_path_control, op_sharing):
+    node_config_list = [CnnNodeConfig(1, [0], CNN_OP, drop_path_control=drop_path_control, op_sharing=op_sharing)]
     for i in range(n_nodes - 1):
         node_config_list.append(
             CnnNodeConfig(2 + i, list(np.linspace(0, 1 + i, 2 + i).astype('int')), CNN_OP,
-                          drop_path_control=drop_path_control))
+                          drop_path_control=drop_path_control, op_sharing=op_sharing))
     return node_config_list
 
 
-def get_gnas_cnn_search_space(n_nodes, drop_path_control, n_cell_type: SearchSpaceType) -> SearchSpace:
-    node_config_list_a = _two_input_cell(n_nodes, drop_path_control)
+def get_gnas_cnn_search_space(n_nodes, drop_path_control, n_cell_type: SearchSpaceType,
+                              op_sharing='None') -> SearchSpace:
+    # op_sharing: how the op weights of a node are shared between its inputs, see CnnNodeConfig
+    node_config_list_a = _two_input_cell(n_nodes, drop_path_control, op_sharing)
     if n_cell_type == SearchSpaceType.CNNSingleCell:
         return SearchSpace(node_config_list_a)
     elif n_cell_type == SearchSpaceType.CNNDualCell:
-        node_config_list_b = _two_input_cell(n_nodes, drop_path_control)
+        node_config_list_b = _two_input_cell(n_nodes, drop_path_control, op_sharing)
         return SearchSpace([node_config_list_a, node_config_list_b], single_block=False)
     elif n_cell_type == SearchSpaceType.CNNTripleCell:
-        node_config_list_b = _two_input_cell(n_nodes, drop_path_control)
-        node_config_list_c = _one_input_cell(n_nodes, drop_path_control)
+        node_config_list_b = _two_input_cell(n_nodes, drop_path_control, op_sharing)
+        node_config_list_c = _one_input_cell(n_nodes, drop_path_control, op_sharing)
         return SearchSpace([node_config_list_a, node_config_list_b, node_config_list_c], single_block=False)
 
 
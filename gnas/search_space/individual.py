@@ -1,15 +1,35 @@
 import numpy as np
 
 
+def genome_key(code):
+    # packed once per individual, used for hashing and equality
+    return np.asarray(code, dtype='int16').tobytes()
+
+
 class Individual(object):
-    def __init__(self, individual_vector, max_inputs, search_space, index=0):
+    __slots__ = ['iv', 'mi', 'ss', 'index', 'code', 'key', '_config_list', '__weakref__']
+
+    def __init__(self, individual_vector, max_inputs, search_space, index=0, code=None):
+        # One contiguous genome buffer, the node vectors are views into it
+        if code is None:
+            code = np.concatenate(individual_vector, axis=0)
+            individual_vector = np.split(code, np.cumsum([len(iv) for iv in individual_vector])[:-1])
         self.iv = individual_vector
         self.mi = max_inputs
         self.ss = search_space
-        # Generate config when generating individual
         self.index = index
-        self.config_list = [oc.parse_config(iv) for iv, oc in zip(self.iv, self.ss.get_opeartion_config(self.index))]
-        self.code = np.concatenate(self.iv, axis=0)
+        self.code = code
+        self.key = genome_key(self.code)
+        self._config_list = None  # decoded on first use
+
+    def __getstate__(self):
+        # the dict state of the individuals pickled before __slots__, without the decoded config list
+        return {'iv': self.iv, 'mi': self.mi, 'ss': self.ss, 'index': self.index}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # default state of a slots object: (dict, slots)
+            state = state[1]
+        self.__init__(state['iv'], state['mi'], state['ss'], index=state.get('index', 0))
 
     def get_length(self):
         return len(self.code)
@@ -21,25 +41,39 @@ class Individual(object):
         return Individual(self.iv, self.mi, self.ss, index=self.index)
 
     def generate_node_config(self):
-        return self.config_list
+        if self._config_list is None:
+            self._config_list = [oc.parse_config(iv) for iv, oc in
+                                 zip(self.iv, self.ss.get_opeartion_config(self.index))]
+        return self._config_list
 
     def update_individual(self, individual_vector):
         return Individual(individual_vector, self.mi, self.ss, index=self.index)
 
     def __eq__(self, other):
-        return np.array_equal(self.code, other.code)
+        return self.key == getattr(other, 'key', None)
 
     def __str__(self):
         return "code:" + str(self.code)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self.key)
 
 
 class MultipleBlockIndividual(object):
+    __slots__ = ['individual_list', 'code', 'key', '__weakref__']
+
     def __init__(self, individual_list):
         self.individual_list = individual_list
         self.code = np.concatenate([i.code for i in self.individual_list])
+        self.key = genome_key(self.code)
+
+    def __getstate__(self):
+        return {'individual_list': self.individual_list}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # default state of a slots object: (dict, slots)
+            state = state[1]
+        self.__init__(state['individual_list'])
 
     def get_individual(self, index):
         return self.individual_list[index]
@@ -51,10 +85,10 @@ class MultipleBlockIndividual(object):
         raise NotImplemented
 
     def __eq__(self, other):
-        return np.array_equal(self.code, other.code)
+        return self.key == getattr(other, 'key', None)
 
     def __str__(self):
         return "code:" + str(self.code)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self.key)
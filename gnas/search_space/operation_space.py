@@ -20,6 +20,9 @@ class RnnInputNodeConfig(object):
     def parse_config(self, oc):
         return vector_bits2int(oc)
 
+    def canonical_vector(self, oc):
+        return oc
+
 
 class RnnNodeConfig(object):
     def __init__(self, node_id, inputs: list, non_linear_list):
@@ -45,13 +48,25 @@ class RnnNodeConfig(object):
         else:
             return self.inputs[oc[0]], oc[0], vector_bits2int(oc[1:])
 
+    def canonical_vector(self, oc):
+        return oc
+
 
 class CnnNodeConfig(object):
-    def __init__(self, node_id, inputs: list, op_list, drop_path_control):
+    def __init__(self, node_id, inputs: list, op_list, drop_path_control, op_sharing='None'):
+        # op_sharing: 'None' one weight copy of an op per input, 'Input' one per branch (a, b) shared by all the
+        # inputs, 'All' one per op shared by both branches
+        if op_sharing not in ['None', 'Input', 'All']:
+            raise Exception('unkown op sharing:' + str(op_sharing))
         self.node_id = node_id
         self.inputs = inputs
         self.op_list = op_list
         self.drop_path_control = drop_path_control
+        self.op_sharing = op_sharing
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('op_sharing', 'None')  # pickled before op sharing
 
     def max_values_vector(self, max_inputs):
         max_inputs = len(self.inputs)
@@ -62,6 +77,16 @@ class CnnNodeConfig(object):
     def get_n_inputs(self):
         return len(self.inputs)
 
+    def get_n_weight_slots(self):
+        if self.op_sharing == 'None':
+            return len(self.inputs)
+        return 2 if self.op_sharing == 'Input' else 1
+
+    def weight_slot(self, input_index, branch):
+        if self.op_sharing == 'None':
+            return input_index
+        return branch if self.op_sharing == 'Input' else 0
+
     def parse_config(self, oc):
         if len(self.inputs) == 1:
             op_a = oc[0]
@@ -76,3 +101,18 @@ class CnnNodeConfig(object):
         input_a = self.inputs[input_index_a]
         input_b = self.inputs[input_index_b]
         return input_a, input_b, input_index_a, input_index_b, op_a, op_b
+
+    def canonical_vector(self, oc):
+        # Both branches are summed and the op weights are selected by input index, so (input_a, op_a) and
+        # (input_b, op_b) can be swapped, keep them sorted. oc can hold a batch of node vectors on the first axis.
+        if self.op_sharing == 'Input':
+            return oc  # every branch has its own op weights, a swap changes the node
+        oc = np.array(oc)
+        n_op = len(self.op_list)
+        if len(self.inputs) == 1:
+            swap = oc[..., 0] > oc[..., 1]
+            oc[swap] = oc[swap][..., [1, 0]]
+        else:
+            swap = oc[..., 0] * n_op + oc[..., 2] > oc[..., 1] * n_op + oc[..., 3]
+            oc[swap] = oc[swap][..., [1, 0, 3, 2]]
+        return oc
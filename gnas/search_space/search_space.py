@@ -1,17 +1,45 @@
+import weakref
 import numpy as np
-from gnas.search_space.individual import Individual, MultipleBlockIndividual
+from gnas.search_space.individual import Individual, MultipleBlockIndividual, genome_key
 
 
 class SearchSpace(object):
     def __init__(self, operation_config_list: list, single_block=True):
         self.single_block = single_block
         self.ocl = operation_config_list
-        if single_block:
-            self.n_elements = sum([len(self.generate_vector(o.max_values_vector(i))) for i, o in enumerate(self.ocl)])
-        else:
-            self.n_elements = sum(
-                [sum([len(self.generate_vector(o.max_values_vector(i))) for i, o in enumerate(block)]) for block in
-                 self.ocl])
+        self._compile_layout()
+        self.intern_table = weakref.WeakValueDictionary()
+
+    def _compile_layout(self):
+        # Flat genome layout, computed once: per gene upper bound and owning node, offsets of every node vector
+        # inside its block and of every block inside the genome.
+        blocks = [self.ocl] if self.single_block else self.ocl
+        self.max_values_list = []
+        self.node_split = []
+        self.block_split = [0]
+        self.node_offset = []  # decoding table: (block index, node config, start, end) per node
+        for b, block in enumerate(blocks):
+            block_max_values = [np.asarray(o.max_values_vector(i)).astype('int') for i, o in enumerate(block)]
+            lengths = np.asarray([len(m) for m in block_max_values], dtype='int')
+            starts = self.block_split[-1] + np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            self.max_values_list.append(block_max_values)
+            self.node_split.append(np.cumsum(lengths)[:-1])
+            self.node_offset.extend([(b, o, s, s + l) for o, s, l in zip(block, starts, lengths)])
+            self.block_split.append(self.block_split[-1] + int(np.sum(lengths)))
+        self.max_values = np.concatenate([np.concatenate(m) for m in self.max_values_list])
+        self.gene_node = np.repeat(np.arange(len(self.node_offset)), [e - s for _, _, s, e in self.node_offset])
+        self.n_elements = len(self.max_values)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['intern_table']  # weak references can't be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'node_offset' not in state:  # pickled before the layout was compiled
+            self._compile_layout()
+        self.intern_table = weakref.WeakValueDictionary()
 
     def get_operation_configs(self):
         return self.ocl
@@ -23,10 +51,7 @@ class SearchSpace(object):
             return [len(ocl) for ocl in self.ocl]
 
     def get_max_values_vector(self, index=0):
-        if self.single_block:
-            return [o.max_values_vector(i) for i, o in enumerate(self.ocl)]
-        else:
-            return [o.max_values_vector(i) for i, o in enumerate(self.ocl[index])]
+        return self.max_values_list[0 if self.single_block else index]
 
     def get_opeartion_config(self, index=0):
         if self.single_block:
@@ -34,20 +59,48 @@ class SearchSpace(object):
         else:
             return self.ocl[index]
 
+    def intern(self, individual):
+        # identical genomes share one individual object while any reference to it is alive
+        return self.intern_table.setdefault(individual.key, individual)
+
     def generate_vector(self, max_values):
-        return np.asarray([np.random.randint(0, mv + 1) for mv in max_values])
+        return np.floor(np.random.rand(len(max_values)) * (np.asarray(max_values) + 1)).astype('int')
 
-    def _generate_individual_single(self, ocl, index=0):
-        operation_vector = [self.generate_vector(o.max_values_vector(i)) for i, o in enumerate(ocl)]
-        max_inputs = [i for i, _ in enumerate(ocl)]
-        return Individual(operation_vector, max_inputs, self, index=index)
+    def generate_genomes(self, size):
+        return np.floor(np.random.rand(size, self.n_elements) * (self.max_values + 1)).astype('int')
 
-    def generate_individual(self):
+    def check_bounds(self, genomes):
+        return np.all(np.logical_and(genomes >= 0, genomes <= self.max_values), axis=-1)
+
+    def canonical_genomes(self, genomes):
+        # map every genome to the representative of its class of functionally equivalent genomes
+        genomes = np.array(genomes)
+        for _, oc, s, e in self.node_offset:
+            genomes[..., s:e] = oc.canonical_vector(genomes[..., s:e])
+        return genomes
+
+    def canonical_individual(self, individual):
+        return self.genome_to_individual(self.canonical_genomes(individual.code))
+
+    def _block_individual(self, block_genome, index):
+        operation_vector = np.split(block_genome, self.node_split[index])
+        return Individual(operation_vector, list(range(len(operation_vector))), self, index=index, code=block_genome)
+
+    def genome_to_individual(self, genome):
+        individual = self.intern_table.get(genome_key(genome))
+        if individual is not None:
+            return individual
+        genome = np.array(genome)  # don't keep a larger genome matrix alive
+        if genome.shape != (self.n_elements,) or not self.check_bounds(genome):
+            raise Exception('genome is not in the search space:' + str(genome))
         if self.single_block:
-            return self._generate_individual_single(self.ocl)
-        else:
-            return MultipleBlockIndividual(
-                [self._generate_individual_single(ocl, index=i) for i, ocl in enumerate(self.ocl)])
+            return self.intern(self._block_individual(genome, 0))
+        return self.intern(MultipleBlockIndividual(
+            [self._block_individual(genome[s:e], i) for i, (s, e) in
+             enumerate(zip(self.block_split[:-1], self.block_split[1:]))]))
+
+    def generate_individual(self):
+        return self.genome_to_individual(self.generate_genomes(1)[0])
 
     def generate_population(self, size):
-        return [self.generate_individual() for _ in range(size)]
+        return [self.genome_to_individual(g) for g in self.generate_genomes(size)]
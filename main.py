@@ -1,4 +1,5 @@
 import time
+import numpy as np
 import torch.nn as nn
 
 import torch
@@ -9,13 +10,15 @@ import argparse
 
 import gnas
 from models import model_cnn, model_rnn
-from cnn_utils import evaluate_single, evaluate_individual_list
-from rnn_utils import train_genetic_rnn, rnn_genetic_evaluate, rnn_evaluate
-from data import get_dataset
+from cnn_utils import evaluate_single, evaluate_individual_list, evaluate_racing
+from rnn_utils import train_genetic_rnn, rnn_genetic_evaluate, rnn_evaluate, rnn_racing_evaluate, rnn_evaluate_single, \
+    rnn_batched_evaluate
+from data import get_dataset, materialize_dataset
 from common import load_final, make_log_dir, get_model_type, ModelType
 from config import get_config, load_config, save_config
 from modules.drop_module import DropModuleControl
 from modules.cosine_annealing import CosineAnnealingLR
+from modules.active_path_sgd import ActivePathSGD
 
 #######################################
 # Constants
@@ -62,17 +65,13 @@ if model_type == ModelType.CNN:
     min_objective = False
     n_cell_type = gnas.SearchSpaceType(config.get('n_block_type') - 1)
     dp_control = DropModuleControl(config.get('drop_path_keep_prob'))
-    ss = gnas.get_gnas_cnn_search_space(config.get('n_nodes'), dp_control, n_cell_type)
+    ss = gnas.get_gnas_cnn_search_space(config.get('n_nodes'), dp_control, n_cell_type,
+                                        config.get('op_sharing'))
 
     net = model_cnn.Net(config.get('n_blocks'), config.get('n_channels'), n_param,
                         config.get('dropout'),
-                        ss, aux=config.get('aux_loss')).to(working_device)
-    ######################################
-    # Build Optimizer and Loss function
-    #####################################
-    optimizer = optim.SGD(net.parameters(), lr=config.get('learning_rate'), momentum=config.get('momentum'),
-                          nesterov=True,
-                          weight_decay=config.get('weight_decay'))
+                        ss, aux=config.get('aux_loss'), checkpoint=config.get('checkpoint_stages'),
+                        lazy_ops=config.get('lazy_ops')).to(working_device)
 elif model_type == ModelType.RNN:
     min_objective = True
     ntokens = n_param
@@ -80,13 +79,33 @@ elif model_type == ModelType.RNN:
     net = model_rnn.RNNModel(ntokens, config.get('n_channels'), config.get('n_channels'), config.get('n_blocks'),
                              config.get('dropout'),
                              tie_weights=True,
-                             ss=ss).to(
+                             ss=ss, compiled_cell=config.get('compiled_cell')).to(
         working_device)
-    ######################################
-    # Build Optimizer and Loss function
-    #####################################
-    optimizer = optim.SGD(net.parameters(), lr=config.get('learning_rate'),
-                          weight_decay=config.get('weight_decay'))
+#######################################
+# Load Indvidual and export the selected path
+#######################################
+if args.final:
+    ind = load_final(net, args.search_dir)
+    if config.get('export_final'): net = gnas.export_network(net, ind)
+######################################
+# Build Optimizer and Loss function
+#####################################
+if model_type == ModelType.CNN:
+    if config.get('active_path'):
+        optimizer = ActivePathSGD(net, lr=config.get('learning_rate'), momentum=config.get('momentum'),
+                                  nesterov=True,
+                                  weight_decay=config.get('weight_decay'))
+    else:
+        optimizer = optim.SGD(net.parameters(), lr=config.get('learning_rate'), momentum=config.get('momentum'),
+                              nesterov=True,
+                              weight_decay=config.get('weight_decay'))
+elif model_type == ModelType.RNN:
+    if config.get('active_path'):
+        optimizer = ActivePathSGD(net, lr=config.get('learning_rate'),
+                                  weight_decay=config.get('weight_decay'))
+    else:
+        optimizer = optim.SGD(net.parameters(), lr=config.get('learning_rate'),
+                              weight_decay=config.get('weight_decay'))
 ######################################
 # Build genetic_algorithm_searcher
 #####################################
@@ -95,7 +114,16 @@ ga = gnas.genetic_algorithm_searcher(ss, generation_size=config.get('generation_
                                      keep_size=config.get('keep_size'), mutation_p=config.get('mutation_p'),
                                      p_cross_over=config.get('p_cross_over'),
                                      cross_over_type=config.get('cross_over_type'),
+                                     engine=config.get('ga_engine'),
+                                     steady_state=config.get('steady_state'),
+                                     canonical=config.get('canonical', False),
                                      min_objective=min_objective)
+fitness_cache = gnas.FitnessCache(config.get('fitness_cache_size'))
+fitness_cache.register_optimizer(optimizer)  # every weight update invalidates the cached fitness
+if config.get('racing') and config.get('racing_keep') >= config.get('generation_size'):
+    raise Exception('racing_keep must be smaller than generation_size')
+racing = gnas.RacingEvaluator(config.get('racing_keep'), confidence=config.get('racing_confidence'),
+                              initial_batches=config.get('racing_initial_batches'), min_objective=min_objective)
 ######################################
 # Loss function
 ######################################
@@ -118,10 +146,36 @@ else:
 ##################################################
 log_dir = make_log_dir(config)
 save_config(log_dir, config)
-#######################################
-# Load Indvidual
-#######################################
-if args.final: ind = load_final(net, args.search_dir)
+######################################
+# Pre-materialize the validation set
+######################################
+if model_type == ModelType.CNN and config.get('val_set') == 'Memory':
+    testloader = materialize_dataset(testloader, working_device)
+elif model_type == ModelType.CNN and config.get('val_set') == 'Mmap':
+    testloader = materialize_dataset(testloader, working_device, log_dir)
+elif model_type == ModelType.CNN and config.get('val_set') != 'Loader':
+    raise Exception('unkown val_set type:' + config.get('val_set'))
+######################################
+# Parallel generation evaluation
+######################################
+evaluator = None
+if config.get('n_eval_workers') > 0 and not args.final:
+    if model_type == ModelType.CNN:
+        if config.get('lazy_ops'):
+            raise Exception('parallel evaluation requires the ops to be built before the workers start (lazy_ops)')
+        if config.get('val_set') == 'Loader':
+            raise Exception('parallel evaluation requires a materialized validation set (val_set)')
+        if not config.get('full_dataset'):
+            raise Exception('parallel evaluation is only used to evaluate on the full dataset (full_dataset)')
+        evaluator = gnas.ParallelEvaluator(net, ss, evaluate_single, (testloader, working_device),
+                                           n_workers=config.get('n_eval_workers'),
+                                           n_threads=config.get('eval_threads'))
+    elif model_type == ModelType.RNN:
+        evaluator = gnas.ParallelEvaluator(net, ss, rnn_evaluate_single,
+                                           (criterion, testloader, ntokens, config.get('batch_size_val'),
+                                            config.get('bptt')),
+                                           n_workers=config.get('n_eval_workers'),
+                                           n_threads=config.get('eval_threads'))
 ##################################################
 # Start Epochs
 ##################################################
@@ -148,6 +202,10 @@ if model_type == ModelType.CNN:
             # sample child from population
             if not args.final:
                 net.set_individual(ga.sample_child())
+            if config.get('lazy_ops'):
+                gnas.modules.add_created_parameters(optimizer, net)  # ops built for the sampled child
+            if config.get('active_path') and (not args.final or i == 0):
+                optimizer.update_active_path()
 
             inputs = inputs.to(working_device)
             labels = labels.to(working_device)
@@ -171,13 +229,16 @@ if model_type == ModelType.CNN:
         # Update GA population
         ############################################
         if args.final:
-            f_max = evaluate_single(ind, net, testloader, working_device)
+            f_max = evaluate_single(ind, net, testloader, working_device, fitness_cache)
             n_diff = 0
         else:
             if config.get('full_dataset'):
-                for ind in ga.get_current_generation():
-                    acc = evaluate_single(ind, net, testloader, working_device)
-                    ga.update_current_individual_fitness(ind, acc)
+                if evaluator is not None:
+                    evaluator.evaluate_generation(ga)  # evaluate the generation in the worker pool
+                else:
+                    for ind in ga.get_current_generation():
+                        acc = evaluate_single(ind, net, testloader, working_device, fitness_cache)
+                        ga.update_current_individual_fitness(ind, acc)
                 _, _, f_max, _, n_diff = ga.update_population()
                 best_individual = ga.best_individual
             else:
@@ -185,14 +246,22 @@ if model_type == ModelType.CNN:
                 f_max = 0
                 n_diff = 0
                 for _ in range(config.get('generation_per_epoch')):
-                    evaluate_individual_list(ga.get_current_generation(), ga, net, testloader,
-                                             working_device)  # evaluate next generation on the validation set
+                    if config.get('racing'):
+                        n_batches = evaluate_racing(ga.get_current_generation(), ga, net, testloader,
+                                                    working_device, racing)  # race next generation
+                        print('| racing | batches per individual {:5.2f} | total batches {:d} |'.format(
+                            np.mean(n_batches), int(np.sum(n_batches))))
+                    else:
+                        evaluate_individual_list(ga.get_current_generation(), ga, net, testloader,
+                                                 working_device,
+                                                 fitness_cache)  # evaluate next generation on the validation set
                     _, _, v_max, _, n_d = ga.update_population()  # replacement
                     n_diff += n_d
                     if v_max > f_max:
                         f_max = v_max
                         best_individual = ga.best_individual
-                f_max = evaluate_single(best_individual, net, testloader, working_device)  # evalute best
+                f_max = evaluate_single(best_individual, net, testloader, working_device,
+                                        fitness_cache)  # evalute best
         if f_max > best:
             print("Update Best")
             best = f_max
@@ -209,6 +278,7 @@ if model_type == ModelType.CNN:
                 scheduler.get_lr()[
                     -1],
                 n_diff))
+        print(fitness_cache)
         ra.add_epoch_result('N', n_diff)
         ra.add_epoch_result('Best', best)
         ra.add_epoch_result('Validation Accuracy', f_max)
@@ -232,16 +302,33 @@ elif model_type == ModelType.RNN:
         if args.final:
             min_loss = rnn_evaluate(net, criterion, testloader, ntokens, config.get('batch_size_val'),
                                     config.get('bptt'))
+        elif evaluator is not None:
+            evaluator.evaluate_generation(ga)
+            val_loss, loss_var, max_loss, min_loss, n_diff = ga.update_population()
+        elif config.get('racing'):
+            val_loss, loss_var, max_loss, min_loss, n_diff = rnn_racing_evaluate(ga, net, criterion, testloader,
+                                                                                 ntokens,
+                                                                                 config.get('batch_size_val'),
+                                                                                 config.get('bptt'), racing)
+        elif config.get('multi_eval_size') > 1:
+            val_loss, loss_var, max_loss, min_loss, n_diff = rnn_batched_evaluate(ga, net, criterion, testloader,
+                                                                                  ntokens,
+                                                                                  config.get('batch_size_val'),
+                                                                                  config.get('bptt'),
+                                                                                  config.get('multi_eval_size'),
+                                                                                  fitness_cache)
         else:
             val_loss, loss_var, max_loss, min_loss, n_diff = rnn_genetic_evaluate(ga, net, criterion, testloader,
                                                                                   ntokens,
                                                                                   config.get('batch_size_val'),
-                                                                                  config.get('bptt'))
+                                                                                  config.get('bptt'),
+                                                                                  fitness_cache)
 
         print('-' * 89)
         print('| end of epoch {:3d} | time: {:5.2f}s | valid loss {:5.2f} | lr {:02.2f} |  '
               ''.format(epoch, (time.time() - epoch_start_time),
                         min_loss, scheduler.get_lr()[-1]))
+        print(fitness_cache)
         print('-' * 89)
         # Save the model if the validation loss is the best we've seen so far.
         if min_loss < best:
@@ -258,4 +345,8 @@ elif model_type == ModelType.RNN:
         ra.add_epoch_result('Best', best)
         if not args.final: ra.add_result('Fitness', ga.ga_result.fitness_list)
         ra.save_result(log_dir)
+if evaluator is not None: evaluator.close()
+if model_type == ModelType.RNN and config.get('stream_corpus'):
+    trainloader.close()  # stop the read ahead threads
+    testloader.close()
 print('Finished Training')
@@ -1,14 +1,17 @@
 import torch.nn as nn
 import gnas
 import torch
+from gnas.modules.node_module import ConvNodeModule
 
 
 class RepeatBlock(nn.Module):
-    def __init__(self, n_blocks, n_channels, ss, individual_index=0, first_block=None):
+    def __init__(self, n_blocks, n_channels, ss, individual_index=0, first_block=None, checkpoint=False,
+                 lazy_ops=False):
         super(RepeatBlock, self).__init__()
         if first_block is None: first_block = individual_index
         self.block_list = [gnas.modules.CnnSearchModule(n_channels, ss,
-                                                        individual_index=first_block if i == 0 else individual_index)
+                                                        individual_index=first_block if i == 0 else individual_index,
+                                                        checkpoint=checkpoint, lazy_ops=lazy_ops)
                            for i in
                            range(n_blocks)]
         [self.add_module('block_' + str(i), n) for i, n in enumerate(self.block_list)]
@@ -25,7 +28,10 @@ class RepeatBlock(nn.Module):
 
 
 class Net(nn.Module):
-    def __init__(self, n_blocks, n_channels, n_classes, dropout, ss, aux=False):
+    def __init__(self, n_blocks, n_channels, n_classes, dropout, ss, aux=False, checkpoint=(False, False, False),
+                 lazy_ops=False):
+        # checkpoint: activation checkpointing of the search blocks of each of the three stages
+        # lazy_ops: the ops of the search blocks are built the first time they are selected
         n_block_types = len(ss.ocl)
         normal_block_index = 0
         reduce_block_index = 0
@@ -39,7 +45,8 @@ class Net(nn.Module):
         self.bn1 = nn.BatchNorm2d(n_channels)
 
         self.block_1 = RepeatBlock(n_blocks, n_channels, ss,
-                                   individual_index=normal_block_index, first_block=first_block_index)
+                                   individual_index=normal_block_index, first_block=first_block_index,
+                                   checkpoint=checkpoint[0], lazy_ops=lazy_ops)
 
         self.avg = nn.AvgPool2d(2)
         self.conv2 = nn.Conv2d(n_channels, 2 * n_channels, 1, stride=1, padding=1, bias=False)
@@ -49,9 +56,11 @@ class Net(nn.Module):
         self.bn2_prev = nn.BatchNorm2d(2 * n_channels)
         # self
 
-        self.block_2_reduce = gnas.modules.CnnSearchModule(2 * n_channels, ss, individual_index=reduce_block_index)
+        self.block_2_reduce = gnas.modules.CnnSearchModule(2 * n_channels, ss, individual_index=reduce_block_index,
+                                                            checkpoint=checkpoint[1], lazy_ops=lazy_ops)
         self.block_2 = RepeatBlock(n_blocks, 2 * n_channels, ss,
-                                   individual_index=normal_block_index)
+                                   individual_index=normal_block_index, checkpoint=checkpoint[1],
+                                   lazy_ops=lazy_ops)
 
         self.conv3 = nn.Conv2d(2 * n_channels, 4 * n_channels, 1, stride=1, padding=1, bias=False)
         self.bn3 = nn.BatchNorm2d(4 * n_channels)
@@ -59,9 +68,11 @@ class Net(nn.Module):
         self.conv3_prev = nn.Conv2d(2 * n_channels, 4 * n_channels, 1, stride=1, padding=1, bias=False)
         self.bn3_prev = nn.BatchNorm2d(4 * n_channels)
 
-        self.block_3_reduce = gnas.modules.CnnSearchModule(4 * n_channels, ss, individual_index=reduce_block_index)
+        self.block_3_reduce = gnas.modules.CnnSearchModule(4 * n_channels, ss, individual_index=reduce_block_index,
+                                                            checkpoint=checkpoint[2], lazy_ops=lazy_ops)
         self.block_3 = RepeatBlock(n_blocks, 4 * n_channels, ss,
-                                   individual_index=normal_block_index)
+                                   individual_index=normal_block_index, checkpoint=checkpoint[2],
+                                   lazy_ops=lazy_ops)
 
         self.relu = nn.ReLU()
         self.dp = nn.Dropout(p=dropout)
@@ -77,6 +88,9 @@ class Net(nn.Module):
         for p in self.parameters():
             if len(p.shape) == 4:
                 nn.init.kaiming_normal_(p)
+        node_list = [m for m in self.modules() if isinstance(m, ConvNodeModule)]
+        for i, m in enumerate(node_list):
+            m.set_lazy_seed(i)  # every node of the network builds its lazy ops from its own seed
 
     def forward(self, x):
         x_prev = self.bn1(self.conv1(x))
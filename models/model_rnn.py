@@ -96,7 +96,7 @@ class LockedDropout(nn.Module):
 class RNNModel(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
-    def __init__(self, ntoken, ninp, nhid, nlayers, dropout=0.5, tie_weights=False, ss=None):
+    def __init__(self, ntoken, ninp, nhid, nlayers, dropout=0.5, tie_weights=False, ss=None, compiled_cell=False):
         super(RNNModel, self).__init__()
         self.drop_input = LockedDropout(0.65)  # TODO:change to input config
         self.drop_end = LockedDropout(0.4)  # TODO:change to input config
@@ -104,7 +104,7 @@ class RNNModel(nn.Module):
         self.ss = ss
         self.rnn = gnas.modules.RnnSearchModule(in_channels=ninp, n_channels=nhid,
                                                 working_device='cuda',
-                                                ss=self.ss)
+                                                ss=self.ss, compiled=compiled_cell)
         self.decoder = nn.Linear(nhid, ntoken)
 
         # Optionally tie weights as in:
@@ -126,6 +126,10 @@ class RNNModel(nn.Module):
     def set_individual(self, individual):
         self.rnn.set_individual(individual)
 
+    def set_individual_list(self, individual_list):
+        # the hidden state then holds a batch per individual, see init_hidden
+        self.rnn.set_individual_list(individual_list)
+
     def init_weights(self):
         initrange = 0.1
         self.encoder.weight.data.uniform_(-initrange, initrange)
@@ -0,0 +1,75 @@
+import torch
+import torch.optim as optim
+
+
+class ActivePathSGD(optim.SGD):
+    r"""SGD that only touches the parameters on the sampled path of a supernet.
+
+    Node modules of the supernet expose ``active_parameters()``, every other parameter of the model is always
+    active. After ``set_individual`` call :meth:`update_active_path`, then :meth:`zero_grad`, :meth:`step` and
+    :meth:`active_parameters` (for gradient clipping) work on the sampled path only, so the step time grows with
+    the path and not with the supernet.
+
+    Parameters that are not on the path are frozen: they get no weight decay and their momentum buffer is
+    neither decayed nor applied until they are sampled again. This is the same as :class:`torch.optim.SGD` for
+    parameters whose gradient is ``None``.
+    """
+
+    def __init__(self, model, lr, momentum=0, dampening=0, weight_decay=0, nesterov=False):
+        super(ActivePathSGD, self).__init__(model.parameters(), lr=lr, momentum=momentum, dampening=dampening,
+                                            weight_decay=weight_decay, nesterov=nesterov)
+        if len(self.param_groups) != 1:
+            raise Exception('ActivePathSGD supports a single parameter group')
+        self.node_modules = [m for m in model.modules() if hasattr(m, 'active_parameters')]
+        node_params = set([id(p) for m in self.node_modules for p in m.parameters()])
+        self.static_params = [p for p in self.param_groups[0]['params'] if id(p) not in node_params]
+        self.active = list(self.param_groups[0]['params'])
+        self.grad_params = dict()  # parameters that may hold a gradient since the last zero_grad
+
+    def update_active_path(self):
+        active = dict([(id(p), p) for p in self.static_params])
+        for m in self.node_modules:
+            active.update([(id(p), p) for p in m.active_parameters()])
+        self.active = list(active.values())
+        self.grad_params.update(active)
+
+    def active_parameters(self):
+        return self.active
+
+    def zero_grad(self, set_to_none=True):
+        for p in self.grad_params.values():
+            if p.grad is None:
+                continue
+            if set_to_none:
+                p.grad = None
+            else:
+                p.grad.detach_()
+                p.grad.zero_()
+        self.grad_params = dict([(id(p), p) for p in self.active])
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        group = self.param_groups[0]
+        for p in self.active:
+            if p.grad is None:
+                continue
+            d_p = p.grad
+            if group['weight_decay'] != 0:
+                d_p = d_p.add(p, alpha=group['weight_decay'])
+            if group['momentum'] != 0:
+                state = self.state[p]
+                buf = state.get('momentum_buffer')
+                if buf is None:
+                    buf = state['momentum_buffer'] = torch.clone(d_p).detach()
+                else:
+                    buf.mul_(group['momentum']).add_(d_p, alpha=1 - group['dampening'])
+                if group['nesterov']:
+                    d_p = d_p.add(buf, alpha=group['momentum'])
+                else:
+                    d_p = buf
+            p.add_(d_p, alpha=-group['lr'])
+        return loss
@@ -1,39 +1,68 @@
 import torch
-import torch.cuda
 import torch.nn as nn
 from random import random
-from torch.autograd import Variable
 
 
 class DropModuleControl(object):
     def __init__(self, drop_prob=0.9):
         self.drop_prob = drop_prob
         self.status = False
+        self.zero_cache = dict()  # (shape, dtype, device) -> zero tensor shared by all the dropped paths
 
     def enable(self):
         self.status = True
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['zero_cache'] = dict()  # pickled individuals reach the control through the search space
+        return state
+
+    def zeros(self, shape, like):
+        key = (tuple(shape), like.dtype, like.device)
+        zeros = self.zero_cache.get(key)
+        if zeros is None:
+            zeros = self.zero_cache[key] = torch.zeros(shape, dtype=like.dtype, device=like.device)
+        return zeros
+
 
 class DropModule(nn.Module):
-    def __init__(self, module, drop_control: DropModuleControl):
+    def __init__(self, module, drop_control: DropModuleControl, out_channels=None):
         super(DropModule, self).__init__()
         self.module = module
-        self.shape = None
         self.drop_control = drop_control
-        self.tensor_init = torch.FloatTensor
+        self.out_channels = out_channels  # None when the module keeps the shape of its input
+
+    def output_shape(self, x):
+        if self.out_channels is None:
+            return x.shape
+        return torch.Size([x.shape[0], self.out_channels, *x.shape[2:]])
 
-    def update_tensor_shape(self, *input):
-        if self.shape is None:
-            output_tensor = self.module(*input)
-            self.shape = output_tensor.size()  # fetch tensor shape
-            if output_tensor.data.is_cuda: self.tensor_init = torch.cuda.FloatTensor
+    def zeros(self, x):
+        # read only, the same tensor is returned for every dropped path of this shape
+        return self.drop_control.zeros(self.output_shape(x), x)
 
     def forward(self, *input):
-        self.update_tensor_shape(*input)
         if self.training and self.drop_control.status:
             if random() <= self.drop_control.drop_prob:  # forward module tensor
                 return self.module(*input) / self.drop_control.drop_prob  # Apply scaling
             else:  # forward zero tensor
-                return Variable(self.tensor_init(torch.Size([input[0].shape[0], *list(self.shape[1:])])).zero_())
+                return self.zeros(input[0])
         else:  # Inference
             return self.module(*input)
+
+
+def drop_path_sum(op_a, x_a, op_b, x_b):
+    """op_a(x_a) + op_b(x_b) for two DropModules with a shared control, the drop path scaling is applied once to
+    the sum and dropped ops are not computed."""
+    control = op_a.drop_control
+    if not (op_a.training and control.status):
+        return op_a.module(x_a) + op_b.module(x_b)
+    keep_a = random() <= control.drop_prob  # drawn in the same order as two DropModule calls
+    keep_b = random() <= control.drop_prob
+    if keep_a and keep_b:
+        return (op_a.module(x_a) + op_b.module(x_b)) / control.drop_prob
+    elif keep_a:
+        return op_a.module(x_a) / control.drop_prob
+    elif keep_b:
+        return op_b.module(x_b) / control.drop_prob
+    return op_a.zeros(x_a)  # both paths dropped, the node is skipped
@@ -61,7 +61,8 @@ if plot_arc:
 
     dp_control = DropModuleControl(config.get('drop_path_keep_prob'))
     n_cell_type = gnas.SearchSpaceType(config.get('n_block_type') - 1)
-    ss = gnas.get_gnas_cnn_search_space(config.get('n_nodes'), dp_control, n_cell_type)
+    ss = gnas.get_gnas_cnn_search_space(config.get('n_nodes'), dp_control, n_cell_type,
+                                        config.get('op_sharing'))
     draw_network(ss, ind, './')
     title_list = ['Reduce Cell', ' Normal Cell', ' Input Cell']
     for i in range(len(ss.ocl)):
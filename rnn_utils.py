@@ -1,7 +1,8 @@
-import os
 import torch
 import time
 import math
+import numpy as np
+from modules.active_path_sgd import ActivePathSGD
 
 
 def get_batch(source, i, bptt):
@@ -14,17 +15,23 @@ def get_batch(source, i, bptt):
     # done along the batch dimension (i.e. dimension 1), since that was handled
     # by the batchify function. The chunks are along dimension 0, corresponding
     # to the seq_len dimension in the LSTM.
+    if not torch.is_tensor(source): return source.get_batch(i, bptt)  # data.TokenStream
     seq_len = min(bptt, len(source) - 1 - i)
     data = source[i:i + seq_len]
     target = source[i + 1:i + 1 + seq_len].view(-1)
     return data, target
 
 
-def rnn_genetic_evaluate(ga, input_model, input_criterion, data_source, ntokens, batch_size, bptt):
+def rnn_genetic_evaluate(ga, input_model, input_criterion, data_source, ntokens, batch_size, bptt,
+                         fitness_cache=None):
     input_model.eval()  # Turn on evaluation mode which disables dropout.
     hidden = input_model.init_hidden(batch_size)
     with torch.no_grad():
         for ind in ga.get_current_generation():
+            loss = None if fitness_cache is None else fitness_cache.get(('full', ind))
+            if loss is not None:
+                ga.update_current_individual_fitness(ind, loss)
+                continue
             input_model.set_individual(ind)
             total_loss = 0
             for i in range(0, data_source.size(0) - 1, bptt):
@@ -33,10 +40,81 @@ def rnn_genetic_evaluate(ga, input_model, input_criterion, data_source, ntokens,
                 output_flat = output.view(-1, ntokens)
                 total_loss += len(data) * input_criterion(output_flat, targets).item()
                 hidden = repackage_hidden(hidden)
+            if fitness_cache is not None: fitness_cache.put(('full', ind), total_loss / (len(data_source) - 1))
             ga.update_current_individual_fitness(ind, total_loss / (len(data_source) - 1))
     return ga.update_population()
 
 
+def rnn_batched_evaluate(ga, input_model, input_criterion, data_source, ntokens, batch_size, bptt, n_parallel,
+                         fitness_cache=None):
+    input_model.eval()  # Turn on evaluation mode which disables dropout.
+    individual_list = []
+    for ind in ga.get_current_generation():
+        loss = None if fitness_cache is None else fitness_cache.get(('full', ind))
+        if loss is None:
+            individual_list.append(ind)
+        else:
+            ga.update_current_individual_fitness(ind, loss)
+    with torch.no_grad():
+        for start in range(0, len(individual_list), n_parallel):  # n_parallel individuals in one wide pass
+            ind_batch = individual_list[start:start + n_parallel]
+            input_model.set_individual_list(ind_batch)
+            hidden = input_model.init_hidden(len(ind_batch) * batch_size)
+            total_loss = np.zeros(len(ind_batch))
+            for i in range(0, data_source.size(0) - 1, bptt):
+                data, targets = get_batch(data_source, i, bptt)
+                output, hidden = input_model(data, hidden)
+                output = output.view(len(data), len(ind_batch), -1, ntokens)
+                for j in range(len(ind_batch)):
+                    total_loss[j] += len(data) * input_criterion(output[:, j].reshape(-1, ntokens), targets).item()
+                hidden = repackage_hidden(hidden)
+            for ind, loss in zip(ind_batch, total_loss / (len(data_source) - 1)):
+                if fitness_cache is not None: fitness_cache.put(('full', ind), float(loss))
+                ga.update_current_individual_fitness(ind, float(loss))
+    return ga.update_population()
+
+
+def rnn_racing_evaluate(ga, input_model, input_criterion, data_source, ntokens, batch_size, bptt, racing):
+    input_model.eval()  # Turn on evaluation mode which disables dropout.
+    start_index = list(range(0, data_source.size(0) - 1, bptt))
+    hidden_dict = dict()  # every individual keeps its own hidden state along the validation stream
+    total_dict = dict()  # len(data) weighted loss and length of the consumed stream, like rnn_evaluate
+
+    def score_function(ind, start, stop):
+        input_model.set_individual(ind)
+        hidden = hidden_dict.get(ind)
+        if hidden is None: hidden = input_model.init_hidden(batch_size)
+        total_loss, total_len = total_dict.get(ind, (0, 0))
+        scores = []
+        for i in start_index[start:stop]:
+            data, targets = get_batch(data_source, i, bptt)
+            output, hidden = input_model(data, hidden)
+            scores.append(input_criterion(output.view(-1, ntokens), targets).item())
+            total_loss += len(data) * scores[-1]
+            total_len += len(data)
+            hidden = repackage_hidden(hidden)
+        hidden_dict[ind] = hidden
+        total_dict[ind] = (total_loss, total_len)
+        return scores
+
+    generation = list(ga.get_current_generation())
+    with torch.no_grad():
+        _, n_batches = racing.race(generation, score_function, len(start_index))
+    fitness = [total_dict[ind][0] / total_dict[ind][1] for ind in generation]
+    full = [n == len(start_index) for n in n_batches]
+    while True:  # the reported best loss must come from the whole validation stream
+        best = int(np.argmin(fitness))
+        if full[best]: break
+        fitness[best] = rnn_evaluate_single(generation[best], input_model, input_criterion, data_source, ntokens,
+                                            batch_size, bptt)
+        full[best] = True
+    for ind, loss in zip(generation, fitness):
+        ga.update_current_individual_fitness(ind, loss)
+    print('| racing | batches per individual {:5.2f} | total batches {:d} |'.format(np.mean(n_batches),
+                                                                                      int(np.sum(n_batches))))
+    return ga.update_population()
+
+
 def rnn_evaluate(input_model, input_criterion, data_source, ntokens, batch_size, bptt):
     input_model.eval()  # Turn on evaluation mode which disables dropout.
     hidden = input_model.init_hidden(batch_size)
@@ -51,6 +129,11 @@ def rnn_evaluate(input_model, input_criterion, data_source, ntokens, batch_size,
     return total_loss / (len(data_source) - 1)
 
 
+def rnn_evaluate_single(input_individual, input_model, input_criterion, data_source, ntokens, batch_size, bptt):
+    input_model.set_individual(input_individual)
+    return rnn_evaluate(input_model, input_criterion, data_source, ntokens, batch_size, bptt)
+
+
 def train_genetic_rnn(ga, train_data, input_model, input_optimizer, input_criterion, ntokens, batch_size, bptt,
                       grad_clip,
                       log_interval, final):
@@ -67,6 +150,11 @@ def train_genetic_rnn(ga, train_data, input_model, input_optimizer, input_criter
         hidden = repackage_hidden(hidden)
         input_optimizer.zero_grad()  # zero old gradients for the next back propgation
         if not final: input_model.set_individual(ga.sample_child())  # updating
+        if isinstance(input_optimizer, ActivePathSGD):
+            if not final or batch == 0: input_optimizer.update_active_path()
+            parameters = input_optimizer.active_parameters()
+        else:
+            parameters = input_model.parameters()
 
         output, hidden = input_model(data, hidden)
         loss = input_criterion(output.view(-1, ntokens), targets)
@@ -74,7 +162,7 @@ def train_genetic_rnn(ga, train_data, input_model, input_optimizer, input_criter
         loss.backward()
 
         # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
-        torch.nn.utils.clip_grad_norm_(input_model.parameters(), grad_clip)
+        torch.nn.utils.clip_grad_norm_(parameters, grad_clip)
         input_optimizer.step()
 
         total_loss += loss.item()
@@ -96,65 +184,3 @@ def repackage_hidden(h):
         return h.detach()
     else:
         return tuple(repackage_hidden(v) for v in h)
-
-
-class Dictionary(object):
-    def __init__(self):
-        self.word2idx = {}
-        self.idx2word = []
-
-    def add_word(self, word):
-        if word not in self.word2idx:
-            self.idx2word.append(word)
-            self.word2idx[word] = len(self.idx2word) - 1
-        return self.word2idx[word]
-
-    def __len__(self):
-        return len(self.idx2word)
-
-
-class Corpus(object):
-    def __init__(self, path):
-        self.dictionary = Dictionary()
-        self.train = self.tokenize(os.path.join(path, 'train.txt'))
-        self.valid = self.tokenize(os.path.join(path, 'valid.txt'))
-        self.test = self.tokenize(os.path.join(path, 'test.txt'))
-
-    @staticmethod
-    def single_batchify(data, bsz, input_device):
-        # Work out how cleanly we can divide the dataset into bsz parts.
-        nbatch = data.size(0) // bsz
-        # Trim off any extra elements that wouldn't cleanly fit (remainders).
-        data = data.narrow(0, 0, nbatch * bsz)
-        # Evenly divide the dataset across the bsz batches.
-        data = data.view(bsz, -1).t().contiguous()
-        return data.to(input_device)
-
-    def batchify(self, bsz, device):
-        return self.single_batchify(self.train, bsz, device), self.single_batchify(self.valid, bsz,
-                                                                                   device), self.single_batchify(
-            self.test, bsz, device)
-
-    def tokenize(self, path):
-        """Tokenizes a text file."""
-        assert os.path.exists(path)
-        # Add words to the dictionary
-        with open(path, 'r', encoding="utf8") as f:
-            tokens = 0
-            for line in f:
-                words = line.split() + ['<eos>']
-                tokens += len(words)
-                for word in words:
-                    self.dictionary.add_word(word)
-
-        # Tokenize file content
-        with open(path, 'r', encoding="utf8") as f:
-            ids = torch.LongTensor(tokens)
-            token = 0
-            for line in f:
-                words = line.split() + ['<eos>']
-                for word in words:
-                    ids[token] = self.dictionary.word2idx[word]
-                    token += 1
-
-        return ids
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import torch
+import numpy as np
+from data import Corpus, TokenStream, BatchAugmentLoader, materialize_dataset
+from rnn_utils import get_batch
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for split, text in [('train', 'a b c\nb a d\n'), ('valid', 'c e a\n'), ('test', 'f b\n\n')]:
+            with open(os.path.join(self.path, split + '.txt'), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_corpus_cache(self):
+        with mock.patch.object(Corpus, 'map_cache', autospec=True, side_effect=Corpus.map_cache) as map_cache:
+            corpus = Corpus(self.path)
+        self.assertTrue(map_cache.called)  # the ids are mapped from the cache once it is written
+        self.assertEqual(corpus.dictionary.idx2word, ['a', 'b', 'c', '<eos>', 'd', 'e', 'f'])
+        self.assertEqual(corpus.train.tolist(), [0, 1, 2, 3, 1, 0, 4, 3])
+        self.assertEqual(corpus.test.tolist(), [6, 1, 3, 3])
+        cached = Corpus(self.path)  # loaded from the cache
+        self.assertEqual(cached.dictionary.word2idx, corpus.dictionary.word2idx)
+        for a, b in [(corpus.train, cached.train), (corpus.valid, cached.valid), (corpus.test, cached.test)]:
+            self.assertTrue(torch.equal(a, b))
+        valid_file = os.path.join(self.path, 'valid.txt')
+        mtime = os.path.getmtime(valid_file)
+        with open(valid_file, 'w') as f:
+            f.write('g a g a\n')  # changing a file invalidates the cache
+        os.utime(valid_file, (mtime + 10, mtime + 10))  # independent of the mtime resolution
+        self.assertEqual(Corpus(self.path).valid.tolist(), [5, 0, 5, 0, 3])
+
+    def test_materialize_dataset(self):
+        dataset = torch.utils.data.TensorDataset(torch.randn(30, 3, 4, 4), torch.randint(0, 10, [30]))
+        loader = torch.utils.data.DataLoader(dataset, batch_size=8, shuffle=False)
+        for path in [None, self.path]:  # 'Memory' and 'Mmap' val_set
+            val_set = materialize_dataset(loader, 'cpu', path)
+            self.assertEqual(len(val_set), len(loader))
+            batches = list(val_set)
+            self.assertEqual(len(batches), len(loader))
+            for (images, labels), (images_ref, labels_ref) in zip(batches, loader):
+                self.assertTrue(torch.equal(images, images_ref))
+                self.assertTrue(torch.equal(labels, labels_ref))
+
+    def test_token_stream(self):
+        ids = torch.from_numpy(np.random.randint(0, 100, 1003))
+        batchified = Corpus.single_batchify(ids, 7, 'cpu')
+        stream = TokenStream(ids.numpy(), 7, 'cpu', prefetch=2)
+        self.assertEqual(len(stream), len(batchified))
+        for start in [list(range(0, len(batchified) - 1, 35)), [70, 0, 105]]:  # in order and out of order
+            for i in start:
+                data, target = get_batch(stream, i, 35)
+                data_ref, target_ref = get_batch(batchified, i, 35)
+                self.assertTrue(torch.equal(data, data_ref))
+                self.assertTrue(torch.equal(target, target_ref))
+        stream.close()
+        self.assertTrue(stream.executor is None)
+
+    def test_batch_augment(self):
+        images = np.random.randint(0, 256, (10, 8, 8, 3)).astype('uint8')
+        mean, std = [0.5, 0.4, 0.3], [0.2, 0.3, 0.4]
+        reference = torch.from_numpy(images).permute(0, 3, 1, 2).float() / 255
+        reference = (reference - torch.tensor(mean).view(1, 3, 1, 1)) / torch.tensor(std).view(1, 3, 1, 1)
+        loader = BatchAugmentLoader(images, list(range(10)), 4, mean, std, padding=0)
+        self.assertEqual(len(loader), 3)
+        for x, labels in loader:  # without padding only the flip changes an image
+            for img, l in zip(x, labels):
+                self.assertTrue(torch.allclose(img, reference[l], atol=1e-5) or
+                                torch.allclose(img, reference[l].flip(dims=[2]), atol=1e-5))
+        loader = BatchAugmentLoader(images, list(range(10)), 10, mean, std, padding=2, n_holes=1, length=4)
+        x, labels = next(iter(loader))
+        self.assertEqual(x.shape, (10, 3, 8, 8))
+        self.assertTrue(torch.all(torch.sum(torch.all(x == 0, dim=1), dim=(1, 2)) >= 4))  # at least a corner hole
@@ -1,6 +1,9 @@
 import numpy as np
 import unittest
 import gnas
+from gnas.genetic_algorithm.population_engine import PopulationEngine
+from gnas.genetic_algorithm.population_dict import PopulationDict
+from gnas.genetic_algorithm.elite_archive import EliteArchive
 
 
 class TestGenetic(unittest.TestCase):
@@ -16,6 +19,118 @@ class TestGenetic(unittest.TestCase):
             self.assertTrue(len(ga.max_dict) <= 200)
             self.assertTrue(len(ga.generation))
 
+    def test_search_cnn_space_array_engine(self):
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNDualCell)
+        ga = gnas.genetic_algorithm_searcher(ss, population_size=20, generation_size=20, engine='Array')
+        for i in range(5):
+            for ind in ga.get_current_generation():
+                ga.update_current_individual_fitness(ind, 0 + np.random.rand(1))
+            ga.update_population()
+            self.assertTrue(len(ga.generation) == 20)
+
+    def test_steady_state(self):
+        import threading
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNSingleCell)
+        ga = gnas.genetic_algorithm_searcher(ss, population_size=10, generation_size=20, steady_state=True,
+                                             engine='Array', min_objective=False)
+        for i in range(5):
+            for ind in ga.get_current_generation():
+                ga.update_current_individual_fitness(ind, np.sum(ind.code))
+            ga.update_population()
+            self.assertTrue(len(ga.max_dict) == 10)
+
+        def worker():
+            for _ in range(50):
+                ind = ga.ask()
+                ga.update_current_individual_fitness(ind, np.sum(ind.code))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertTrue(len(ga.current_dict) > 0)
+        self.assertTrue(len(ga.pending) == 0)
+        self.assertTrue(len(ga.max_dict) == 10)
+        ga.update_population()
+        self.assertTrue(ga.sample_child() is not None)
+
+    def test_population_engine(self):
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNTripleCell)
+        for cross_over_type in ['Bit', 'Block']:
+            engine = PopulationEngine(ss, 0.2, 1.0, cross_over_type)
+            genomes = engine.random_genomes(100)
+            self.assertTrue(genomes.shape[1] == ss.n_elements)
+            self.assertFalse(np.any(genomes > engine.max_values))
+            for g in genomes[:10]:  # decode and encode back
+                self.assertTrue(np.array_equal(engine.to_genomes([engine.to_individual(g)])[0], g))
+            child_a, child_b = engine.cross_over(genomes[:50], genomes[50:])
+            self.assertTrue(np.all((child_a == genomes[:50]) | (child_a == genomes[50:])))
+            self.assertTrue(np.array_equal(child_a + child_b, genomes[:50] + genomes[50:]))
+            mutated = engine.mutation(genomes)
+            self.assertFalse(np.any(mutated > engine.max_values))
+            self.assertFalse(np.any(mutated < 0))
+            generation = engine.new_generation(genomes, np.ones(100) / 100, 20)
+            self.assertTrue(generation.shape == (20, ss.n_elements))
+            self.assertTrue(len(engine.deduplicate(generation)) == 20)
+        engine = PopulationEngine(ss, 0.2, 1.0, canonical=True)  # opt-in canonical form
+        genomes = engine.random_genomes(50)
+        self.assertTrue(np.array_equal(genomes, ss.canonical_genomes(genomes)))
+
+    def test_elite_archive(self):
+        for min_max in [True, False]:
+            archive = EliteArchive(10, min_max=min_max)
+            reference = PopulationDict()
+            for _ in range(30):
+                current = {k: v for k, v in zip(np.random.randint(0, 40, 8), np.random.rand(8))}
+                total = reference.copy()
+                total.update(current)
+                best = total.filter_top_n(10, min_max=min_max)
+                n_diff = reference.get_n_diff(best)
+                reference = best
+                self.assertTrue(archive.update(current) == n_diff)
+                self.assertTrue(set(archive.keys()) == set(reference.keys()))
+                self.assertTrue(all([archive.get(k) == v for k, v in reference.items()]))
+                self.assertTrue(all([k in archive for k in archive.sample(5)]))
+        archive = EliteArchive(2)
+        [archive.insert(k, v) for k, v in [(0, 0.1), (1, 0.2), (2, 0.3), (3, 0.0), (1, 0.4)]]
+        self.assertTrue(archive.churn() == (3, 1, 1, 1))  # inserts, evictions, rejections, updates
+        self.assertTrue(archive.churn() == (0, 0, 0, 0))
+
+    def test_fitness_cache(self):
+        import torch
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNSingleCell)
+        cache = gnas.FitnessCache(max_size=5)
+        w = torch.nn.Parameter(torch.ones(1))
+        optimizer = torch.optim.SGD([w], lr=0.1)
+        cache.register_optimizer(optimizer)
+        population = ss.generate_population(6)
+        for i, ind in enumerate(population):
+            self.assertTrue(cache.get(('full', ind)) is None)
+            cache.put(('full', ind), i)
+        self.assertTrue(len(cache) == 5)
+        self.assertTrue(cache.get(('full', population[0])) is None)  # evicted
+        self.assertTrue(cache.get(('full', population[5].copy())) == 5)
+        w.grad = torch.ones(1)
+        optimizer.step()
+        self.assertTrue(cache.get(('full', population[5])) is None)  # weights changed
+        self.assertTrue(cache.n_hit == 1 and cache.n_miss == 8)
+
+    def test_racing(self):
+        true_mean = np.linspace(0, 100, 20)
+
+        def score_function(ind, start, stop):
+            return list(true_mean[ind] + np.random.randn(stop - start))
+
+        for min_objective in [False, True]:
+            racing = gnas.RacingEvaluator(5, confidence=0.99, min_objective=min_objective)
+            fitness, n_batches = racing.race(list(range(20)), score_function, 64)
+            top = np.argsort(true_mean)[:5] if min_objective else np.argsort(true_mean)[-5:]
+            ranked = np.argsort(fitness)[:5] if min_objective else np.argsort(fitness)[-5:]
+            self.assertTrue(set(top) == set(ranked))
+            self.assertTrue(np.sum(n_batches) < 20 * 64)
+            self.assertTrue(racing.batches[top[0]] == np.max(n_batches))
+        with self.assertRaises(Exception):  # nothing could be dropped, every candidate would stop after one round
+            gnas.RacingEvaluator(5).race(list(range(5)), score_function, 64)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,26 @@
 import unittest
+from unittest import mock
 import torch
+import numpy as np
 import gnas
 import time
 from tests.common4testing import generate_ss, generate_ss_cnn
 from gnas.modules.sub_graph_module import SubGraphModule
+from gnas.modules.node_module import ConvNodeModule
 from modules.drop_module import DropModuleControl
+from modules.active_path_sgd import ActivePathSGD
+
+
+def _output_sum(individual, model, x):
+    model.eval()
+    model.set_individual(individual)
+    with torch.no_grad():
+        return model(x, x).sum().item()
+
+
+def _fail(individual, model):
+    raise ValueError('bad individual')
+
 
 class TestModules(unittest.TestCase):
     def test_sub_graph_build_rnn(self):
@@ -33,6 +49,43 @@ class TestModules(unittest.TestCase):
             x = torch.randn(32, 64, 16, 16, dtype=torch.float)
             res = sgm(x, y)
 
+    def test_cnn_canonical_equivalence(self):
+        ss = generate_ss_cnn()
+        sgm = SubGraphModule(ss, {'n_channels': 16}).eval()
+        y = torch.randn(4, 16, 8, 8, dtype=torch.float)
+        x = torch.randn(4, 16, 8, 8, dtype=torch.float)
+        with torch.no_grad():
+            for i in range(10):
+                individual = ss.generate_individual()
+                sgm.set_individual(individual)
+                res = sgm(x, y)
+                sgm.set_individual(ss.canonical_individual(individual))
+                res_canonical = sgm(x, y)
+                self.assertTrue(all([torch.allclose(a, b, atol=1e-5) for a, b in zip(res, res_canonical)]))
+
+    def test_plan_cache(self):
+        ss = generate_ss_cnn()
+        sgm = SubGraphModule(ss, {'n_channels': 16}, plan_cache_size=2).eval()
+        y = torch.randn(4, 16, 8, 8, dtype=torch.float)
+        x = torch.randn(4, 16, 8, 8, dtype=torch.float)
+        individual_list = [ss.generate_individual() for _ in range(3)]
+        with torch.no_grad():
+            res = []
+            for ind in individual_list:
+                sgm.set_individual(ind)
+                res.append(sgm(x, y)[-1])
+            self.assertEqual(len(sgm.plan_cache), 2)
+            for j, (ind, r) in enumerate(zip(reversed(individual_list), reversed(res))):
+                if j < 2:  # a cache hit applies the resolved nodes without parsing their configs again
+                    with mock.patch.object(ConvNodeModule, 'set_current_node_config', side_effect=AssertionError):
+                        sgm.set_individual(ind)
+                else:
+                    sgm.set_individual(ind)
+                self.assertTrue(torch.allclose(sgm(x, y)[-1], r))
+                active = set([id(p) for nm in sgm.block_modules for p in nm.active_parameters()])
+                self.assertTrue(all([p.requires_grad == (id(p) in active) for p in sgm.parameters()]))
+            self.assertTrue(sgm.plan is sgm.plan_cache[individual_list[0].key])
+
     def test_cnn_module(self):
         batch_size = 64
         h, w = 16, 16
@@ -53,6 +106,36 @@ class TestModules(unittest.TestCase):
         self.assertTrue(output.shape[2] == h)
         self.assertTrue(output.shape[3] == w)
 
+    def test_cnn_op_sharing(self):
+        x = torch.randn(2, 8, 8, 8, dtype=torch.float)
+        y = torch.randn(2, 8, 8, 8, dtype=torch.float)
+        n_params = dict()
+        for op_sharing in ['None', 'Input', 'All']:
+            ss = gnas.get_gnas_cnn_search_space(5, DropModuleControl(1), gnas.SearchSpaceType.CNNSingleCell,
+                                                op_sharing=op_sharing)
+            module = gnas.modules.CnnSearchModule(n_channels=8, ss=ss)
+            n_params[op_sharing] = sum([p.numel() for p in module.parameters()])
+            ind = ss.generate_individual()
+            module.set_individual(ind)
+            self.assertEqual(module(x, x).shape, x.shape)
+            module.eval()
+            with torch.no_grad():
+                for _ in range(5):  # the canonical form must compute the same nodes under every sharing mode
+                    ind = ss.generate_individual()
+                    module.sub_graph_module.set_individual(ind)
+                    res = module.sub_graph_module(x, y)
+                    module.sub_graph_module.set_individual(ss.canonical_individual(ind))
+                    res_canonical = module.sub_graph_module(x, y)
+                    self.assertTrue(all([torch.allclose(a, b, atol=1e-5) for a, b in zip(res, res_canonical)]))
+            if op_sharing == 'All':
+                node = module.sub_graph_module.block_modules[-1]
+                node.set_current_node_config([0, 1, 0, 1, 0, 0])  # the same op on two inputs
+                self.assertTrue(node.op_a is node.op_b)
+        self.assertTrue(n_params['None'] > n_params['Input'] > n_params['All'])
+        with self.assertRaises(Exception):
+            gnas.get_gnas_cnn_search_space(5, DropModuleControl(1), gnas.SearchSpaceType.CNNSingleCell,
+                                           op_sharing='Branch')
+
     def test_rnn_module(self):
         batch_size = 64
         in_channels = 300
@@ -73,6 +156,227 @@ class TestModules(unittest.TestCase):
         self.assertTrue(output.shape[0] == time_steps)
         self.assertTrue(output.shape[2] == out_channels)
 
+    def test_rnn_fused_projections(self):
+        ss = gnas.get_gnas_rnn_search_space(6)
+        rnn = gnas.modules.RnnSearchModule(in_channels=16, n_channels=16, working_device='cpu', ss=ss)
+        rnn.set_individual(ss.generate_individual())
+        input = torch.randn(5, 3, 16, dtype=torch.float)
+        state = rnn.init_state(3)
+        torch.manual_seed(0)
+        output, _ = rnn(input, state)
+        torch.manual_seed(0)
+        state = state[0]
+        input_node, node_list = rnn.sub_graph_module.block_modules[0], rnn.sub_graph_module.block_modules[1:]
+        input_node.resample_weights()  # the same masks for the whole sequence
+        for i, x in enumerate(input):  # reference without the hoisted projections
+            net = [x, state, input_node.step(input_node.project_input(x), state)]
+            for nm in node_list:
+                net.append(nm(net))
+            state = torch.mean(torch.stack([net[j] for j in rnn.sub_graph_module.avg_index], dim=-1), dim=-1)
+            self.assertTrue(torch.allclose(output[i], state, atol=1e-5))
+        nm = rnn.sub_graph_module.block_modules[1]
+        x = torch.randn(3, 16, dtype=torch.float)
+        c = torch.sigmoid(nm.x_linear(x))
+        self.assertTrue(torch.allclose(nm([None, None, x]), c * nm.non_linear(nm.h_linear(x)) + (1 - c) * x,
+                                       atol=1e-5))
+
+    def test_rnn_compiled_cell(self):
+        ss = gnas.get_gnas_rnn_search_space(6)
+        rnn = gnas.modules.RnnSearchModule(in_channels=16, n_channels=16, working_device='cpu', ss=ss,
+                                           compiled=True, cell_cache_size=2)
+        input = torch.randn(5, 3, 16, dtype=torch.float)
+        for i in range(3):
+            rnn.set_individual(ss.generate_individual())
+            rnn.compiled = True
+            torch.manual_seed(i)
+            output, state = rnn(input, rnn.init_state(3))
+            rnn.compiled = False
+            torch.manual_seed(i)
+            output_ref, state_ref = rnn(input, rnn.init_state(3))
+            self.assertTrue(torch.allclose(output, output_ref, atol=1e-5))
+            self.assertTrue(torch.allclose(state, state_ref, atol=1e-5))
+        self.assertEqual(len(rnn.cell_cache), 2)
+
+    def test_rnn_multi_individual(self):
+        ss = gnas.get_gnas_rnn_search_space(8)
+        rnn = gnas.modules.RnnSearchModule(in_channels=16, n_channels=16, working_device='cpu', ss=ss)
+        individual_list = [ss.generate_individual() for _ in range(4)]
+        input = torch.randn(5, 3, 16, dtype=torch.float)
+        with torch.no_grad():
+            rnn.set_individual_list(individual_list)
+            torch.manual_seed(0)
+            output, state = rnn(input, rnn.init_state(12))
+            output = output.view(5, 4, 3, 16)
+            for i, ind in enumerate(individual_list):
+                rnn.set_individual(ind)
+                torch.manual_seed(0)  # the same weight drop mask
+                output_ref, state_ref = rnn(input, rnn.init_state(3))
+                self.assertTrue(torch.allclose(output[:, i], output_ref, atol=1e-5))
+                self.assertTrue(torch.allclose(state.view(4, 3, 16)[i], state_ref[0], atol=1e-5))
+
+    def test_drop_path_sum(self):
+        import random
+        dp_control = DropModuleControl(0.5)
+        dp_control.enable()
+        ss = gnas.get_gnas_cnn_search_space(4, dp_control, gnas.SearchSpaceType.CNNSingleCell)
+        sgm = SubGraphModule(ss, {'n_channels': 8})
+        x = torch.randn(2, 8, 4, 4, dtype=torch.float)
+        n_skipped = 0
+        for i in range(20):
+            sgm.set_individual(ss.generate_individual())
+            nm = sgm.block_modules[-1]
+            random.seed(i)
+            output = nm([x, x, x, x, x])
+            random.seed(i)
+            self.assertTrue(torch.allclose(output, nm.op_a(x) + nm.op_b(x), atol=1e-5))
+            n_skipped += output is dp_control.zeros(x.shape, x)
+        self.assertTrue(n_skipped > 0)
+
+    def test_cnn_checkpoint(self):
+        import copy
+        import random
+        dp_control = DropModuleControl(0.5)
+        dp_control.enable()
+        ss = gnas.get_gnas_cnn_search_space(4, dp_control, gnas.SearchSpaceType.CNNSingleCell)
+        module = gnas.modules.CnnSearchModule(n_channels=8, ss=ss)
+        module_ref = copy.deepcopy(module)
+        module.checkpoint = True
+        x = torch.randn(4, 8, 8, 8, dtype=torch.float)
+        for i in range(5):
+            individual = ss.generate_individual()
+            for m in [module, module_ref]:
+                m.set_individual(individual)
+                m.zero_grad()
+                random.seed(i)
+                m(x, x).pow(2).mean().backward()
+            for p, p_ref in zip(module.parameters(), module_ref.parameters()):
+                self.assertTrue((p.grad is None) == (p_ref.grad is None))
+                if p.grad is not None: self.assertTrue(torch.allclose(p.grad, p_ref.grad, atol=1e-5))
+            for b, b_ref in zip(module.buffers(), module_ref.buffers()):
+                self.assertTrue(torch.allclose(b.float(), b_ref.float(), atol=1e-6))
+
+    def test_lazy_ops(self):
+        from models import model_cnn
+        ss = gnas.get_gnas_cnn_search_space(4, DropModuleControl(1), gnas.SearchSpaceType.CNNSingleCell)
+        individual_list = [ss.generate_individual() for _ in range(3)]
+        torch.manual_seed(0)
+        net = model_cnn.Net(1, 8, 10, 0.0, ss, lazy_ops=True)
+        n_params = len(list(net.parameters()))
+        optimizer = ActivePathSGD(net, lr=0.1)
+        [net.set_individual(ind) for ind in individual_list]
+        gnas.modules.add_created_parameters(optimizer, net)
+        self.assertTrue(len(list(net.parameters())) > n_params)
+        self.assertEqual(len(optimizer.param_groups[0]['params']), len(list(net.parameters())))
+        torch.manual_seed(0)
+        net_b = model_cnn.Net(1, 8, 10, 0.0, ss, lazy_ops=True)
+        [net_b.set_individual(ind) for ind in reversed(individual_list)]  # another creation order
+        state_dict = net.state_dict()
+        self.assertEqual(set(state_dict.keys()), set(net_b.state_dict().keys()))
+        self.assertTrue(all([torch.equal(v, net_b.state_dict()[k]) for k, v in state_dict.items()]))
+        net_c = model_cnn.Net(1, 8, 10, 0.0, ss, lazy_ops=True)
+        net_c.load_state_dict(state_dict)  # builds the ops held by the checkpoint
+        self.assertEqual(set(state_dict.keys()), set(net_c.state_dict().keys()))
+        op_name = [k for k in state_dict if '.conv_op_' in k][0]
+        op_name = op_name[:op_name.index('.', op_name.index('.conv_op_') + 1) + 1]  # e.g. '...Node2.conv_op_1_in_0.'
+        legacy_name = op_name[:op_name.index('conv_op_')] + 'op_a.'
+        legacy_state_dict = dict(state_dict)  # the selected ops were saved a second time as op_a/op_b
+        legacy_state_dict.update([(k.replace(op_name, legacy_name), v) for k, v in state_dict.items() if
+                                  k.startswith(op_name)])
+        self.assertTrue(len(legacy_state_dict) > len(state_dict))
+        net_c.load_state_dict(legacy_state_dict)
+
+    def test_active_path_sgd(self):
+        import copy
+        ss = gnas.get_gnas_cnn_search_space(4, DropModuleControl(1), gnas.SearchSpaceType.CNNSingleCell)
+        module = gnas.modules.CnnSearchModule(n_channels=8, ss=ss)
+        module_ref = copy.deepcopy(module)
+        optimizer = ActivePathSGD(module, lr=0.1, momentum=0.9, weight_decay=0.01, nesterov=True)
+        optimizer_ref = torch.optim.SGD(module_ref.parameters(), lr=0.1, momentum=0.9, weight_decay=0.01,
+                                        nesterov=True)
+        x = torch.randn(4, 8, 8, 8, dtype=torch.float)
+        for i in range(10):
+            individual = ss.generate_individual()
+            for m, opt in [(module, optimizer), (module_ref, optimizer_ref)]:
+                m.set_individual(individual)
+                if opt is optimizer: opt.update_active_path()
+                opt.zero_grad(set_to_none=True)
+                m(x, x).pow(2).mean().backward()
+                opt.step()
+            self.assertTrue(len(optimizer.active_parameters()) < len(list(module.parameters())))
+            for p, p_ref in zip(module.parameters(), module_ref.parameters()):
+                self.assertTrue(torch.allclose(p, p_ref, atol=1e-6))
+
+    def test_export_network(self):
+        from models import model_cnn, model_rnn
+        ss = gnas.get_gnas_cnn_search_space(4, DropModuleControl(1), gnas.SearchSpaceType.CNNDualCell)
+        net = model_cnn.Net(1, 8, 10, 0.0, ss).eval()
+        x = torch.randn(2, 3, 16, 16, dtype=torch.float)
+        individual = ss.generate_individual()
+        fixed = gnas.export_network(net, individual)
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(net(x)[0], fixed(x)[0], atol=1e-5))
+        self.assertTrue(sum([p.numel() for p in fixed.parameters()]) < sum([p.numel() for p in net.parameters()]))
+        fixed.set_individual(individual)
+        self.assertRaises(Exception, fixed.set_individual, ss.generate_individual())
+
+        ss = gnas.get_gnas_rnn_search_space(4)
+        rnn = model_rnn.RNNModel(20, 16, 16, 1, tie_weights=True, ss=ss).eval()
+        tokens = torch.randint(0, 20, (5, 2))
+        individual = ss.generate_individual()
+        fixed = gnas.export_network(rnn, individual)
+        with torch.no_grad():
+            torch.manual_seed(0)  # the variational weight drop samples a mask even in eval mode
+            output = rnn(tokens, rnn.init_hidden(2))[0]
+            torch.manual_seed(0)
+            self.assertTrue(torch.allclose(output, fixed(tokens, fixed.init_hidden(2))[0], atol=1e-5))
+        self.assertTrue(sum([p.numel() for p in fixed.parameters()]) < sum([p.numel() for p in rnn.parameters()]))
+
+    def test_rnn_racing_rescore(self):
+        import rnn_utils
+        from models import model_rnn
+
+        class OneBatchRace(object):  # every candidate is stopped after the first batch
+            def race(self, individual_list, score_function, n_batches):
+                return [np.mean(score_function(ind, 0, 1)) for ind in individual_list], [1] * len(individual_list)
+
+        ss = gnas.get_gnas_rnn_search_space(4)
+        rnn = model_rnn.RNNModel(20, 16, 16, 1, tie_weights=True, ss=ss)
+        data_source = torch.randint(0, 20, (40, 2))
+        ga = gnas.genetic_algorithm_searcher(ss, population_size=4, generation_size=4, min_objective=True)
+        full_loss = []
+
+        def evaluate_single(*args):
+            full_loss.append(rnn_utils.rnn_evaluate(*args[1:]))
+            return full_loss[-1]
+
+        with mock.patch.object(rnn_utils, 'rnn_evaluate_single', side_effect=evaluate_single):
+            min_loss = rnn_utils.rnn_racing_evaluate(ga, rnn, torch.nn.CrossEntropyLoss(), data_source, 20, 2, 5,
+                                                     OneBatchRace())[3]
+        self.assertTrue(len(full_loss) > 0)
+        self.assertTrue(min_loss in full_loss)  # the best loss comes from the whole validation stream
+
+    def test_parallel_evaluator(self):
+        ss = gnas.get_gnas_cnn_search_space(4, DropModuleControl(1), gnas.SearchSpaceType.CNNSingleCell)
+        module = gnas.modules.CnnSearchModule(n_channels=8, ss=ss)
+        x = torch.randn(4, 8, 8, 8, dtype=torch.float)
+        evaluator = gnas.ParallelEvaluator(module, ss, _output_sum, (x,), n_workers=2)
+        population = ss.generate_population(6)
+        self.assertTrue(evaluator.evaluate(population) == [_output_sum(ind, module, x) for ind in population])
+        with torch.no_grad():
+            [p.mul_(2) for p in module.parameters()]  # weight updates are seen by the workers
+        self.assertTrue(evaluator.evaluate(population) == [_output_sum(ind, module, x) for ind in population])
+        ga = gnas.genetic_algorithm_searcher(ss, population_size=4, generation_size=8, steady_state=True,
+                                             engine='Array')
+        evaluator.evaluate_generation(ga)
+        self.assertTrue(len(ga.current_dict) == 8)
+        self.assertTrue(all([f == _output_sum(ind, module, x) for ind, f in ga.current_dict.items()]))
+        evaluator.close()
+        evaluator = gnas.ParallelEvaluator(module, ss, _fail, n_workers=1)
+        with self.assertRaises(Exception) as context:  # reported instead of waiting for the result forever
+            evaluator.evaluate(population[:2])
+        self.assertTrue('bad individual' in str(context.exception))
+        evaluator.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import numpy as np
 import os
 import inspect
+import pickle
 
 from gnas.search_space.operation_space import RnnInputNodeConfig, RnnNodeConfig
 from gnas.search_space.search_space import SearchSpace
@@ -55,11 +56,70 @@ class TestSearchSpace(unittest.TestCase):
         self.assertTrue(len(dict2test) == 2)
         # res_dict
 
+    def test_individual_key(self):
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNDualCell)
+        individual_a = ss.generate_individual()
+        individual_b = individual_flip_mutation(individual_a, 0)
+        self.assertFalse(individual_a is individual_b)
+        self.assertTrue(individual_a == individual_b)
+        self.assertTrue(hash(individual_a) == hash(individual_b))
+        self.assertTrue(ss.intern(individual_b) is individual_a)
+        individual_c = pickle.loads(pickle.dumps(individual_a))
+        self.assertTrue(individual_c == individual_a)
+        self.assertTrue(len(individual_c.get_individual(0).ss.intern_table) == 0)
+
+    def test_individual_buffer(self):
+        ss = self.generate_ss()
+        individual = ss.generate_individual()
+        self.assertFalse(hasattr(individual, '__dict__'))
+        self.assertTrue(individual._config_list is None)
+        self.assertTrue(all([np.shares_memory(iv, individual.code) for iv in individual.iv]))
+        self.assertTrue(len(individual.generate_node_config()) == ss.get_n_nodes())
+        self.assertTrue(individual.generate_node_config() is individual.generate_node_config())
+
+    def test_individual_legacy_state(self):
+        # state of a search space and an individual pickled before the compiled layout and __slots__
+        ss = SearchSpace.__new__(SearchSpace)
+        ss.__setstate__({'single_block': True, 'ocl': self.generate_block()})
+        iv = [np.asarray(m) for m in ss.max_values_list[0]]
+        individual = Individual.__new__(Individual)
+        individual.__setstate__({'iv': iv, 'mi': 0, 'ss': ss, 'index': 0, 'code': np.concatenate(iv),
+                                 'config_list': [oc.parse_config(v) for v, oc in zip(iv, ss.ocl)]})
+        self.assertTrue(individual == Individual(iv, 0, ss))
+        self.assertTrue(individual._config_list is None)
+        individual_b = pickle.loads(pickle.dumps(individual))
+        self.assertTrue(individual_b == individual)
+        self.assertTrue(len(individual_b.generate_node_config()) == ss.get_n_nodes())
+
     def test_basic_multiple(self):
         ss = self.generate_ss_multiple_blocks()
         individual = ss.generate_individual()
         self._test_individual(individual, ss.get_n_nodes())
 
+    def test_layout(self):
+        ss = gnas.get_gnas_cnn_search_space(30, 1, gnas.SearchSpaceType.CNNTripleCell)
+        genomes = ss.generate_genomes(1000)
+        self.assertTrue(genomes.shape == (1000, ss.n_elements))
+        self.assertTrue(np.all(ss.check_bounds(genomes)))
+        self.assertFalse(ss.check_bounds(ss.max_values + 1))
+        individual = ss.genome_to_individual(genomes[0])
+        self.assertTrue(np.array_equal(individual.code, genomes[0]))
+        self.assertRaises(Exception, ss.genome_to_individual, ss.max_values + 1)
+        self.assertTrue(len(ss.generate_population(10)) == 10)
+
+    def test_canonical(self):
+        ss = gnas.get_gnas_cnn_search_space(5, 1, gnas.SearchSpaceType.CNNTripleCell)
+        genomes = ss.generate_genomes(200)
+        swapped = np.array(genomes)
+        for _, oc, s, e in ss.node_offset:
+            swapped[:, s:e] = swapped[:, s:e][:, [1, 0, 3, 2] if e - s == 4 else [1, 0]]
+        canonical = ss.canonical_genomes(genomes)
+        self.assertTrue(np.array_equal(canonical, ss.canonical_genomes(swapped)))
+        self.assertTrue(np.array_equal(canonical, ss.canonical_genomes(canonical)))
+        self.assertTrue(np.all(ss.check_bounds(canonical)))
+        self.assertTrue(ss.canonical_individual(ss.genome_to_individual(swapped[0])) == ss.genome_to_individual(
+            canonical[0]))
+
     def test_mutation(self):
         ss = self.generate_ss()
         for i in range(100):